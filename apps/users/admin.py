@@ -1,6 +1,9 @@
 from django.contrib import admin
 
-from .models import User, OneTimePassword
+from .models import User, OneTimePassword, EmailOutbox, AuthEvent, RevokedToken
 
 admin.site.register(User)
-admin.site.register(OneTimePassword)
\ No newline at end of file
+admin.site.register(OneTimePassword)
+admin.site.register(EmailOutbox)
+admin.site.register(AuthEvent)
+admin.site.register(RevokedToken)
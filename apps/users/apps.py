@@ -6,3 +6,11 @@ class UsersConfig(AppConfig):
 
     def ready(self):
         import users.signals
+
+        from django.db import connections
+        from django.db.backends.signals import connection_created
+        from users.timing import install_query_timer
+
+        connection_created.connect(install_query_timer)
+        for connection in connections.all(initialized_only=True):
+            install_query_timer(connection=connection)
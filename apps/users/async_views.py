@@ -0,0 +1,329 @@
+"""
+Native async versions of the auth endpoints, used instead of the DRF views in
+views.py when ASYNC_AUTH_VIEWS is on (the default under config/asgi.py).
+
+Database access goes through the async ORM, password hashing is awaited on the
+hashing executor and image processing is handed to the background pool, so a
+request never ties up a thread while it waits.
+"""
+import json
+
+from django.contrib.auth import aauthenticate as aauthenticate_credentials, get_user_model
+from django.http import HttpResponseNotModified, JsonResponse, QueryDict
+from django.http.multipartparser import MultiPartParserError
+from django.utils.decorators import classonlymethod
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, serializers, status
+from rest_framework_simplejwt.serializers import PasswordField
+
+from .auth_events import record_login, record_otp_check
+from .authentication import aauthenticate, abump_token_version
+from .groups import aadd_to_group
+from .hashing import ahash_password
+from .images import process_profile_image, read_upload
+from .otp import get_otp_backend
+from .profile_cache import aget_profile_representation, cache_headers, is_not_modified
+from .roles import STUDENT, aget_user_groups
+from .routers import afrom_primary
+from .serializers import (
+    CustomTokenObtainPairSerializer,
+    SetNewPasswordSerializer,
+    UserProfileSerializer,
+    UserRegistrationSerializer,
+    VerifyEmailSerializer,
+)
+from .tasks import submit
+from .throttling import OTP_THROTTLE_CLASSES
+from .utils import asend_otp_via_email, asend_verification_email
+
+User = get_user_model()
+
+
+class RegistrationInputSerializer(UserRegistrationSerializer):
+    # uniqueness is checked with the async ORM instead of the UniqueValidator
+    email = serializers.EmailField(max_length=254)
+
+
+class LoginInputSerializer(serializers.Serializer):
+    email = serializers.CharField()
+    password = PasswordField()
+
+
+class EmailInputSerializer(serializers.Serializer):
+    email = serializers.EmailField()
+
+
+class VerifyEmailInputSerializer(EmailInputSerializer):
+    otp = serializers.CharField(max_length=5)
+
+
+class SetNewPasswordInputSerializer(VerifyEmailInputSerializer):
+    password = serializers.CharField(write_only=True, min_length=8)
+    confirm_password = serializers.CharField(write_only=True, min_length=8)
+
+    def validate(self, attrs):
+        if attrs['password'] != attrs['confirm_password']:
+            raise serializers.ValidationError({'password': "Passwords do not match"})
+        return attrs
+
+
+class AsyncAPIView(View):
+    """
+    Minimal async counterpart of APIView: parses JSON or form bodies, applies
+    the throttles and turns DRF exceptions into the same JSON error responses.
+    """
+    throttle_classes = []
+    throttle_scope = None
+
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        # token authenticated API, same as DRF's APIView
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            request.data = self.get_data(request)
+            await self.check_throttles(request)
+            return await super().dispatch(request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            return self.handle_exception(exc)
+
+    async def check_throttles(self, request):
+        durations = []
+        for throttle_class in self.throttle_classes:
+            throttle = throttle_class()
+            if not await throttle.aallow_request(request, self):
+                durations.append(throttle.wait())
+        if durations:
+            raise exceptions.Throttled(max(durations))
+
+    def handle_exception(self, exc):
+        if isinstance(exc.detail, (list, dict)):
+            data = exc.detail
+        else:
+            data = {'detail': exc.detail}
+        response = JsonResponse(data, status=exc.status_code, safe=False)
+        if getattr(exc, 'wait', None):
+            response['Retry-After'] = '%d' % exc.wait
+        return response
+
+    def get_data(self, request):
+        if request.content_type in ('multipart/form-data', 'application/x-www-form-urlencoded'):
+            post, files = self.parse_form(request)
+            data = post.dict()
+            data.update(files.dict())
+            return data
+        if not request.body:
+            return {}
+        try:
+            return json.loads(request.body)
+        except ValueError as exc:
+            raise exceptions.ParseError(f'JSON parse error - {exc}')
+
+    def parse_form(self, request):
+        # Django only fills request.POST / request.FILES for POST
+        if request.method == 'POST':
+            return request.POST, request.FILES
+        if request.content_type == 'application/x-www-form-urlencoded':
+            return QueryDict(request.body, encoding=request.encoding), QueryDict()
+        try:
+            return request.parse_file_upload(request.META, request)
+        except MultiPartParserError as exc:
+            raise exceptions.ParseError(f'Multipart form parse error - {exc}')
+
+    def validate(self, serializer_class, request, **kwargs):
+        serializer = serializer_class(data=request.data, context={'request': request}, **kwargs)
+        serializer.is_valid(raise_exception=True)
+        return serializer
+
+
+class AsyncRegistrationView(AsyncAPIView):
+    throttle_classes = OTP_THROTTLE_CLASSES
+    throttle_scope = 'register'
+
+    async def post(self, request):
+        serializer = self.validate(RegistrationInputSerializer, request)
+        validated_data = dict(serializer.validated_data)
+
+        if await User.objects.filter(email=validated_data['email']).aexists():
+            raise exceptions.ValidationError({'email': ['user with this email address already exists.']})
+
+        validated_data.pop('confirm_password', None)
+        password = validated_data.pop('password')
+        profile_image = validated_data.pop('profile_image', None)
+
+        user = await User.objects.acreate_user(password=password, is_active=False, **validated_data)
+
+        await aadd_to_group(user, STUDENT)
+
+        if profile_image:
+            submit(process_profile_image, user.pk, read_upload(profile_image))
+
+        await asend_verification_email(user)
+
+        return JsonResponse({
+            'message': "User registered successfully. Please check your email to verify your account.",
+            'user': UserRegistrationSerializer(user, context={'request': request}).data
+        }, status=status.HTTP_201_CREATED)
+
+
+class AsyncLoginView(AsyncAPIView):
+    async def post(self, request):
+        serializer = self.validate(LoginInputSerializer, request)
+        email = serializer.validated_data['email']
+        password = serializer.validated_data['password']
+
+        # the configured backends, a failure is recorded by the user_login_failed receiver
+        user = await aauthenticate_credentials(request, email=email, password=password)
+        if user is None:
+            raise exceptions.AuthenticationFailed('No active account found with the given credentials')
+
+        await aget_user_groups(user)
+        refresh = CustomTokenObtainPairSerializer.get_token(user)
+        record_login(user, request)
+
+        return JsonResponse({
+            'refresh': str(refresh),
+            'access': str(refresh.access_token),
+            'user': CustomTokenObtainPairSerializer.get_user_data(user),
+        })
+
+
+class AsyncVerifyEmailView(AsyncAPIView):
+    throttle_classes = OTP_THROTTLE_CLASSES
+    throttle_scope = 'verify_email'
+
+    async def post(self, request):
+        serializer = self.validate(VerifyEmailInputSerializer, request)
+
+        user = await User.objects.filter(email=serializer.validated_data['email']).afirst()
+        if user is None:
+            raise exceptions.AuthenticationFailed('User not found')
+
+        result = await get_otp_backend().averify(user, serializer.validated_data['otp'])
+        record_otp_check(user.pk, result, request)
+        VerifyEmailSerializer.check_otp_result(result)
+
+        if not user.is_active:
+            user.is_active = True
+            await user.asave(update_fields=['is_active'])
+
+        return JsonResponse(
+            {'message': 'Email verified successfully. You can now log in.'},
+            status=status.HTTP_200_OK
+        )
+
+
+class AsyncResendActivationEmailView(AsyncAPIView):
+    throttle_classes = OTP_THROTTLE_CLASSES
+    throttle_scope = 'resend_activation'
+
+    async def post(self, request):
+        serializer = self.validate(EmailInputSerializer, request)
+
+        user = await User.objects.filter(email=serializer.validated_data['email']).afirst()
+        if user is None:
+            raise exceptions.ValidationError({'non_field_errors': ["User with this email does not exists."]})
+        if user.is_active:
+            raise exceptions.ValidationError({'non_field_errors': ["This account is already active."]})
+
+        await asend_verification_email(user)
+
+        return JsonResponse(
+            {'message': 'A new verification code has been sent to your email.'},
+            status=status.HTTP_200_OK
+        )
+
+
+class AsyncPasswordResetRequestView(AsyncAPIView):
+    throttle_classes = OTP_THROTTLE_CLASSES
+    throttle_scope = 'password_reset'
+
+    async def post(self, request):
+        serializer = self.validate(EmailInputSerializer, request)
+
+        user = await User.objects.filter(email=serializer.validated_data['email']).afirst()
+        if user is None:
+            raise exceptions.ValidationError({'email': ["User with this email does not exist."]})
+
+        await asend_otp_via_email(user)
+
+        return JsonResponse(
+            {'message': "We have sent an OTP to your email address."},
+            status=status.HTTP_200_OK
+        )
+
+
+class AsyncPasswordResetConfirmView(AsyncAPIView):
+    throttle_classes = OTP_THROTTLE_CLASSES
+    throttle_scope = 'password_reset_confirm'
+
+    async def patch(self, request):
+        serializer = self.validate(SetNewPasswordInputSerializer, request)
+
+        user = await User.objects.filter(email=serializer.validated_data['email']).afirst()
+        if user is None:
+            raise exceptions.AuthenticationFailed('User not found.')
+
+        result = await get_otp_backend().averify(user, serializer.validated_data['otp'])
+        record_otp_check(user.pk, result, request)
+        SetNewPasswordSerializer.check_otp_result(result)
+
+        user.password = await ahash_password(serializer.validated_data['password'])
+        await user.asave(update_fields=['password'])
+
+        # log out every session that was using the old password
+        await abump_token_version([user.pk])
+
+        return JsonResponse(
+            {'message': 'Password reset successful.'},
+            status=status.HTTP_200_OK
+        )
+
+
+class AsyncUserProfileView(AsyncAPIView):
+    async def get(self, request):
+        user = await aauthenticate(request)
+
+        async def serialize():
+            await afrom_primary(user)
+            await aget_user_groups(user)
+            return UserProfileSerializer(user, context={'request': request}).data
+
+        entry = await aget_profile_representation(request, user.pk, serialize)
+        if is_not_modified(request, entry):
+            response = HttpResponseNotModified()
+        else:
+            response = JsonResponse(entry['data'])
+        for header, value in cache_headers(entry).items():
+            response[header] = value
+        return response
+
+    async def put(self, request):
+        return await self.update(request, partial=False)
+
+    async def patch(self, request):
+        return await self.update(request, partial=True)
+
+    async def update(self, request, partial):
+        user = await aauthenticate(request)
+        await aget_user_groups(user)
+
+        serializer = UserProfileSerializer(
+            user, data=request.data, partial=partial, context={'request': request}
+        )
+        serializer.is_valid(raise_exception=True)
+
+        validated_data = dict(serializer.validated_data)
+        profile_image = validated_data.pop('profile_image', None)
+        if validated_data:
+            for field, value in validated_data.items():
+                setattr(user, field, value)
+            await user.asave(update_fields=list(validated_data))
+
+        # the new image shows up once the background job has resized and stored it
+        if profile_image:
+            submit(process_profile_image, user.pk, read_upload(profile_image))
+
+        return JsonResponse(serializer.data)
@@ -0,0 +1,186 @@
+"""
+Write-behind buffer for login side effects.
+
+Logins, refreshes and OTP checks only append to an in-process buffer; a
+background thread writes it every AUTH_EVENT_FLUSH_INTERVAL seconds as one
+bulk UPDATE of last_login and one bulk INSERT of AuthEvent rows, so a login
+spike doesn't turn into a row UPDATE per login. Whatever is left is written
+when the process exits.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.db.models import F, Q, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .metrics import LOGIN_FAILURE, LOGIN_SUCCESS, OTP_CHECKS
+from .models import AuthEvent
+from .otp import OTP_VALID
+from .profile_cache import invalidate_profiles
+from .tasks import submit
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_last_logins = {}  # user id -> latest login
+_events = []  # (event, user id, email, ip address, created at)
+_flusher_pid = None
+
+
+def get_client_ip(request):
+    return request.META.get('REMOTE_ADDR') if request is not None else None
+
+
+def record_event(event, user_id=None, request=None, email=None):
+    """
+    Buffers an AuthEvent. Failed logins pass the email instead of the user,
+    it is resolved to the user when the buffer is written.
+    """
+    if event == AuthEvent.LOGIN_FAILED:
+        LOGIN_FAILURE.inc()
+    with _lock:
+        _events.append((event, user_id, email, get_client_ip(request), timezone.now()))
+        size = len(_events)
+    _after_record(size)
+
+
+def record_otp_check(user_id, result, request=None):
+    OTP_CHECKS.labels(result).inc()
+    record_event(AuthEvent.OTP_VERIFIED if result == OTP_VALID else AuthEvent.OTP_FAILED, user_id, request)
+
+
+def record_login(user, request=None):
+    LOGIN_SUCCESS.inc()
+    now = timezone.now()
+    # the response and the rest of the request see the new value right away
+    user.last_login = now
+    with _lock:
+        _last_logins[user.pk] = now
+        _events.append((AuthEvent.LOGIN, user.pk, None, get_client_ip(request), now))
+        size = len(_events)
+    _after_record(size)
+
+
+def _after_record(size):
+    if not settings.AUTH_EVENT_FLUSH_INTERVAL:
+        # buffering switched off, written right away but still off the request thread
+        submit(flush)
+        return
+    _start_flusher()
+    if size >= settings.AUTH_EVENT_BUFFER_SIZE:
+        submit(flush)
+
+
+def _start_flusher():
+    # one thread per process, started after a fork by the first login the worker sees
+    global _flusher_pid
+    if _flusher_pid == os.getpid():
+        return
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    threading.Thread(target=_flush_periodically, name='auth-events-flush', daemon=True).start()
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(settings.AUTH_EVENT_FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception:
+            logger.exception("Writing buffered auth events failed")
+        finally:
+            connections.close_all()
+
+
+def take():
+    # hands over everything buffered so far and starts a new buffer
+    global _last_logins, _events
+    with _lock:
+        last_logins, events = _last_logins, _events
+        _last_logins, _events = {}, []
+    return last_logins, events
+
+
+def flush():
+    """
+    Writes the buffer, returns the number of (last logins, events) written.
+    On a database error the batch goes back into the buffer for the next try.
+    """
+    last_logins, events = take()
+    if not last_logins and not events:
+        return 0, 0
+
+    try:
+        _write(last_logins, events)
+    except Exception:
+        _requeue(last_logins, events)
+        raise
+    return len(last_logins), len(events)
+
+
+def _write(last_logins, events):
+    User = get_user_model()
+    batch_size = settings.AUTH_EVENT_BUFFER_SIZE
+
+    if last_logins:
+        # never move last_login backwards, another process may have written a later login already
+        User.objects.bulk_update(
+            [
+                User(pk=user_id, last_login=Greatest(Coalesce(F('last_login'), Value(login)), Value(login)))
+                for user_id, login in last_logins.items()
+            ],
+            ['last_login'],
+            batch_size=batch_size,
+        )
+        # bulk_update() sends no post_save
+        invalidate_profiles(list(last_logins))
+
+    if events:
+        # one query resolves the emails of failed logins and skips users deleted in the meantime
+        # ids come as UUIDs from user objects and as strings from token claims
+        user_ids = {str(user_id) for _, user_id, _, _, _ in events if user_id}
+        emails = {email for _, user_id, email, _, _ in events if not user_id and email}
+        found = list(User.objects.filter(Q(pk__in=user_ids) | Q(email__in=emails)).values_list('pk', 'email'))
+        existing = {str(pk) for pk, _ in found}
+        by_email = {email: str(pk) for pk, email in found}
+
+        AuthEvent.objects.bulk_create(
+            [
+                AuthEvent(
+                    event=event,
+                    user_id=str(user_id) if str(user_id) in existing else by_email.get(email),
+                    ip_address=ip_address,
+                    created_at=created_at,
+                )
+                for event, user_id, email, ip_address, created_at in events
+            ],
+            batch_size=batch_size,
+        )
+
+
+def _requeue(last_logins, events):
+    global _last_logins, _events
+    with _lock:
+        # logins recorded since take() are newer
+        _last_logins = {**last_logins, **_last_logins}
+        # drop the oldest events rather than growing without bound while the database is down
+        _events = (events + _events)[-settings.AUTH_EVENT_BUFFER_SIZE * 10:]
+
+
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception:
+        logger.exception("Writing buffered auth events at exit failed")
+
+
+atexit.register(_flush_at_exit)
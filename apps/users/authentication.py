@@ -0,0 +1,188 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import F
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework.exceptions import NotAuthenticated
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from .caching import adelete_on_commit, delete_on_commit
+from .revocation import ais_revoked, is_revoked
+from .routers import primary
+
+User = get_user_model()
+
+# claim holding User.token_version at the time the token was issued
+TOKEN_VERSION_CLAIM = 'ver'
+
+
+def _version_key(user_id):
+    return f'users:token_version:{user_id}'
+
+
+def get_token_version(user_id):
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        with primary():
+            version = User.objects.filter(pk=user_id).values_list('token_version', flat=True).first()
+        if version is None:
+            return None
+        cache.set(key, version, settings.TOKEN_VERSION_CACHE_TIMEOUT)
+    return version
+
+
+def bump_token_version(user_ids):
+    """
+    Invalidates every token issued so far to the given users,
+    e.g. after a deactivation or a password reset.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    User.objects.filter(pk__in=user_ids).update(token_version=F('token_version') + 1)
+    invalidate_token_versions(user_ids)
+
+
+def invalidate_token_versions(user_ids):
+    # for callers that bump token_version in their own UPDATE
+    delete_on_commit([_version_key(user_id) for user_id in user_ids])
+
+
+async def abump_token_version(user_ids):
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    await User.objects.filter(pk__in=user_ids).aupdate(token_version=F('token_version') + 1)
+    await adelete_on_commit([_version_key(user_id) for user_id in user_ids])
+
+
+def check_token_version(validated_token, current_version):
+    # tokens issued before the claim existed count as version 0
+    if validated_token.get(TOKEN_VERSION_CLAIM, 0) != current_version:
+        raise AuthenticationFailed('Token has been revoked.', code='token_revoked')
+
+
+def check_not_revoked(validated_token):
+    # logged out tokens, see users.revocation
+    if is_revoked(validated_token.get(api_settings.JTI_CLAIM)):
+        raise AuthenticationFailed('Token has been revoked.', code='token_revoked')
+
+
+class ClaimsUser(TokenUser):
+    """
+    Lightweight user built from the token claims. The `users.User` row is
+    only loaded when something asks for a field that is not in the token.
+    """
+
+    @cached_property
+    def email(self):
+        return self.token.get('email', '')
+
+    @cached_property
+    def role(self):
+        return self.token.get('role')
+
+    @cached_property
+    def is_active(self):
+        return self.token.get('is_active', True)
+
+    @cached_property
+    def instance(self):
+        user = User.objects.get(pk=self.id)
+        # reuse the group names already resolved for this request
+        user._group_names = self.__dict__.get('_group_names')
+        return user
+
+    @property
+    def groups(self):
+        return self.instance.groups
+
+    def __getattr__(self, attr):
+        if attr in self.token:
+            return super().__getattr__(attr)
+        # private attributes are probed with getattr(user, name, default), e.g. by users.roles
+        if attr == 'token' or attr.startswith('_'):
+            raise AttributeError(attr)
+        return getattr(self.instance, attr)
+
+
+def get_user_instance(user):
+    # the `users.User` instance behind request.user, whichever authentication class is used
+    if isinstance(user, ClaimsUser):
+        return user.instance
+    return user
+
+
+class VersionedJWTAuthentication(JWTAuthentication):
+    """
+    The default simplejwt authentication, rejecting tokens issued before
+    the last deactivation or password reset.
+    """
+
+    def get_user(self, validated_token):
+        user = super().get_user(validated_token)
+        check_token_version(validated_token, user.token_version)
+        check_not_revoked(validated_token)
+        return user
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    Opt-in authentication that trusts the token claims instead of loading the
+    user on every request (JWT_STATELESS_AUTH=True). Revocation is still
+    enforced through the cached token version.
+    """
+
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        if not validated_token.get('is_active', True):
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+
+        user = ClaimsUser(validated_token)
+        user_id = validated_token[api_settings.USER_ID_CLAIM]
+        current_version = cache.get(_version_key(user_id))
+        if current_version is None:
+            # the row has to be read anyway, load all of it so a view that
+            # needs the instance doesn't run a second query
+            with primary():
+                instance = User.objects.filter(pk=user_id).first()
+            if instance is None:
+                raise AuthenticationFailed('User not found', code='user_not_found')
+            current_version = instance.token_version
+            cache.set(_version_key(user_id), current_version, settings.TOKEN_VERSION_CACHE_TIMEOUT)
+            user.instance = instance
+        check_token_version(validated_token, current_version)
+        check_not_revoked(validated_token)
+
+        return user
+
+
+async def aauthenticate(request):
+    """
+    JWT authentication for the async views, loading the user with the async ORM.
+    """
+    authentication = JWTAuthentication()
+
+    header = authentication.get_header(request)
+    raw_token = authentication.get_raw_token(header) if header is not None else None
+    if raw_token is None:
+        raise NotAuthenticated()
+
+    validated_token = authentication.get_validated_token(raw_token)
+    try:
+        user = await User.objects.aget(pk=validated_token[api_settings.USER_ID_CLAIM])
+    except (KeyError, User.DoesNotExist):
+        raise AuthenticationFailed('User not found', code='user_not_found')
+
+    if not user.is_active:
+        raise AuthenticationFailed('User is inactive', code='user_inactive')
+    check_token_version(validated_token, user.token_version)
+    if await ais_revoked(validated_token.get(api_settings.JTI_CLAIM)):
+        raise AuthenticationFailed('Token has been revoked.', code='token_revoked')
+    return user
@@ -0,0 +1,64 @@
+import hashlib
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.core.cache import cache
+
+from .images import attach_profile_image, store_profile_image
+from .metrics import AVATAR_DOWNLOAD_SECONDS
+from .timing import timed
+
+_session = None
+
+
+class AvatarTooLarge(Exception):
+    pass
+
+
+def get_session():
+    # one pooled session per process, keeps connections to the avatar CDN alive between jobs
+    global _session
+    if _session is None:
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=settings.BACKGROUND_TASK_WORKERS)
+        _session = requests.Session()
+        _session.mount('https://', adapter)
+        _session.mount('http://', adapter)
+    return _session
+
+
+def download_avatar(url):
+    max_bytes = settings.AVATAR_MAX_BYTES
+
+    with (
+        timed('http'),
+        AVATAR_DOWNLOAD_SECONDS.time(),
+        get_session().get(url, timeout=settings.AVATAR_FETCH_TIMEOUT, stream=True) as response,
+    ):
+        response.raise_for_status()
+
+        if int(response.headers.get('Content-Length') or 0) > max_bytes:
+            raise AvatarTooLarge(url)
+
+        content = bytearray()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            content.extend(chunk)
+            if len(content) > max_bytes:
+                raise AvatarTooLarge(url)
+
+    return bytes(content)
+
+
+def ingest_avatar(user_id, picture_url):
+    """
+    Background job: fetch the social account picture and attach it to the user.
+    """
+    url_key = 'avatars:url:' + hashlib.sha256(picture_url.encode()).hexdigest()
+
+    stored = cache.get(url_key)
+    if stored is None:
+        stored = store_profile_image(download_avatar(picture_url))
+        cache.set(url_key, stored, settings.AVATAR_CACHE_TIMEOUT)
+
+    # keep an image the user uploaded in the meantime
+    attach_profile_image(user_id, stored, replace=False)
@@ -0,0 +1,29 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+from .hashing import ahash_password
+
+User = get_user_model()
+
+
+class ExecutorModelBackend(ModelBackend):
+    """
+    ModelBackend whose async path never hashes on the event loop. For an
+    unknown email ModelBackend.aauthenticate() hashes the password with the
+    synchronous set_password() to even out the timing, this awaits the hash
+    on the executor from users.hashing instead.
+    """
+
+    async def aauthenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = await User._default_manager.aget_by_natural_key(username)
+        except User.DoesNotExist:
+            await ahash_password(password)
+            return None
+        if await user.acheck_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
@@ -0,0 +1,95 @@
+"""
+Set based admin operations on many users at once. Every chunk of ids is one
+UPDATE, or one through-table INSERT / DELETE, in its own transaction.
+
+These queries send no model signals, so the caches the signals would have
+cleared (roles, profiles, token versions) are invalidated once for the
+whole batch at the end.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+
+from .authentication import invalidate_token_versions
+from .profile_cache import invalidate_profiles
+from .roles import invalidate_user_groups
+
+User = get_user_model()
+Membership = User.groups.through
+
+ACTIVATE = 'activate'
+DEACTIVATE = 'deactivate'
+ADD_GROUP = 'add_group'
+REMOVE_GROUP = 'remove_group'
+ACTIONS = [ACTIVATE, DEACTIVATE, ADD_GROUP, REMOVE_GROUP]
+
+
+def chunks(user_ids):
+    size = settings.BULK_USER_CHUNK_SIZE
+    for start in range(0, len(user_ids), size):
+        yield user_ids[start:start + size]
+
+
+def set_active(user_ids, active):
+    """
+    Returns the number of users whose is_active changed. Deactivation also
+    revokes their tokens, like the post_save signal does for a single user.
+    """
+    changed = 0
+    for chunk in chunks(user_ids):
+        with transaction.atomic():
+            users = User.objects.filter(pk__in=chunk, is_active=not active)
+            if active:
+                changed += users.update(is_active=True)
+            else:
+                changed += users.update(is_active=False, token_version=F('token_version') + 1)
+
+    invalidate_profiles(user_ids)
+    if not active:
+        invalidate_token_versions(user_ids)
+    return changed
+
+
+def add_to_group(user_ids, group):
+    """
+    Returns the number of memberships created, users already in the group are skipped.
+    """
+    added = 0
+    for chunk in chunks(user_ids):
+        with transaction.atomic():
+            existing = set(User.objects.filter(pk__in=chunk).values_list('pk', flat=True))
+            existing -= set(Membership.objects.filter(group=group, user_id__in=existing).values_list('user_id', flat=True))
+            Membership.objects.bulk_create(
+                [Membership(user_id=user_id, group_id=group.pk) for user_id in existing],
+                ignore_conflicts=True,
+            )
+            added += len(existing)
+
+    invalidate_user_groups(user_ids)
+    invalidate_profiles(user_ids)
+    return added
+
+
+def remove_from_group(user_ids, group):
+    removed = 0
+    for chunk in chunks(user_ids):
+        with transaction.atomic():
+            removed += Membership.objects.filter(group=group, user_id__in=chunk).delete()[0]
+
+    invalidate_user_groups(user_ids)
+    invalidate_profiles(user_ids)
+    return removed
+
+
+def apply(action, user_ids, group=None):
+    user_ids = list(user_ids)
+    if action == ACTIVATE:
+        return set_active(user_ids, True)
+    if action == DEACTIVATE:
+        return set_active(user_ids, False)
+    if action == ADD_GROUP:
+        return add_to_group(user_ids, group)
+    if action == REMOVE_GROUP:
+        return remove_from_group(user_ids, group)
+    raise ValueError(f'Unknown action {action!r}')
@@ -0,0 +1,21 @@
+from django.core.cache import cache
+from django.db import transaction
+
+
+def delete_on_commit(keys):
+    """
+    Deletes cache keys that hold data derived from rows being changed. Inside
+    a transaction they are deleted again once it commits, a concurrent reader
+    may have cached the old data from the primary in between.
+    """
+    if not keys:
+        return
+    cache.delete_many(keys)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+async def adelete_on_commit(keys):
+    # the async ORM never runs inside a transaction, the write is already committed
+    if keys:
+        await cache.adelete_many(keys)
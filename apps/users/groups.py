@@ -0,0 +1,90 @@
+"""
+Process-level registry of the role groups.
+
+The Admin and Student groups are created by a data migration, so their ids
+never change while the process runs. They are loaded with one query (at
+startup, see warm(), or on first use) and memberships are then written as
+a single INSERT into the through table, without looking the group up again.
+Renaming or deleting a group resets the registry of the process that did it;
+the role groups are not meant to be changed at runtime.
+"""
+import threading
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+
+from .profile_cache import invalidate_profiles
+from .roles import ADMIN, STUDENT, invalidate_user_groups
+
+ROLE_GROUPS = (ADMIN, STUDENT)
+
+_lock = threading.Lock()
+_group_ids = None  # group name -> pk
+
+
+def _load():
+    group_ids = dict(Group.objects.filter(name__in=ROLE_GROUPS).values_list('name', 'pk'))
+    for name in ROLE_GROUPS:
+        if name not in group_ids:
+            # deleted since the migration ran, recreated once for this process
+            group_ids[name] = Group.objects.get_or_create(name=name)[0].pk
+    return group_ids
+
+
+def get_group_ids():
+    global _group_ids
+    if _group_ids is None:
+        with _lock:
+            if _group_ids is None:
+                _group_ids = _load()
+    return _group_ids
+
+
+def get_group_id(name):
+    return get_group_ids()[name]
+
+
+async def aget_group_id(name):
+    # read once, reset() may clear the global at any time
+    group_ids = _group_ids
+    if group_ids is None:
+        group_ids = await sync_to_async(get_group_ids)()
+    return group_ids[name]
+
+
+def warm():
+    get_group_ids()
+
+
+def reset():
+    # a role group was renamed or deleted, the next call reloads the ids
+    global _group_ids
+    _group_ids = None
+
+
+def _membership(user, group_id):
+    Membership = get_user_model().groups.through
+    return Membership(user_id=user.pk, group_id=group_id)
+
+
+def _invalidate(user):
+    # writing the through table directly sends no m2m_changed
+    user._group_names = None
+    invalidate_user_groups([user.pk])
+    invalidate_profiles([user.pk])
+
+
+def add_to_group(user, name):
+    """
+    Adds the user to one of the role groups with a single INSERT.
+    """
+    membership = _membership(user, get_group_id(name))
+    type(membership).objects.bulk_create([membership], ignore_conflicts=True)
+    _invalidate(user)
+
+
+async def aadd_to_group(user, name):
+    membership = _membership(user, await aget_group_id(name))
+    await type(membership).objects.abulk_create([membership], ignore_conflicts=True)
+    await sync_to_async(_invalidate)(user)
@@ -0,0 +1,67 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, make_password
+from django.contrib.auth.hashers import verify_password as _verify_password
+
+from .timing import timed
+
+_executor = None
+
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    Django's PBKDF2 hasher with the work factor taken from PASSWORD_HASH_ITERATIONS.
+    It keeps the 'pbkdf2_sha256' algorithm name, so existing hashes stay valid and
+    are upgraded on the next login whenever the setting changes.
+    """
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASH_ITERATIONS
+
+
+def get_hashing_executor():
+    # hashlib releases the GIL, so a thread pool spreads hashing over the cores
+    # while capping how many hashes run at once
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.PASSWORD_HASHING_WORKERS,
+            thread_name_prefix='password-hash',
+        )
+    return _executor
+
+
+def hash_password(raw_password):
+    with timed('hash'):
+        return get_hashing_executor().submit(make_password, raw_password).result()
+
+
+def verify_password(raw_password, encoded):
+    """
+    Returns (is_correct, must_update) like django.contrib.auth.hashers.verify_password.
+    """
+    with timed('hash'):
+        return get_hashing_executor().submit(_verify_password, raw_password, encoded).result()
+
+
+async def ahash_password(raw_password):
+    with timed('hash'):
+        return await asyncio.wrap_future(get_hashing_executor().submit(make_password, raw_password))
+
+
+async def averify_password(raw_password, encoded):
+    with timed('hash'):
+        return await asyncio.wrap_future(get_hashing_executor().submit(_verify_password, raw_password, encoded))
+
+
+def upgrade_password_hash(user_id, old_encoded, raw_password):
+    """
+    Background job: re-hash with the current hasher and work factor. Skipped if
+    the password was changed in the meantime.
+    """
+    User = get_user_model()
+    User.objects.filter(pk=user_id, password=old_encoded).update(password=make_password(raw_password))
@@ -0,0 +1,97 @@
+import hashlib
+from io import BytesIO
+
+from PIL import Image, ImageOps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from .timing import timed
+
+User = get_user_model()
+
+
+def load_image(data):
+    max_size = settings.PROFILE_IMAGE_MAX_SIZE
+
+    image = Image.open(BytesIO(data))
+    # JPEGs are decoded at a reduced scale straight away, a 12 MP photo never gets fully decoded
+    image.draft('RGB', (max_size, max_size))
+    image = ImageOps.exif_transpose(image)
+
+    if image.mode in ('RGBA', 'LA', 'P'):
+        # flatten transparency onto white, JPEG has no alpha channel
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    image.thumbnail((max_size, max_size), Image.LANCZOS)
+    return image
+
+
+def encode_image(image, size=None):
+    if size is not None:
+        image = image.copy()
+        image.thumbnail((size, size), Image.LANCZOS)
+
+    # a fresh encode without exif/icc arguments strips all metadata
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', quality=settings.PROFILE_IMAGE_QUALITY, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def save_file(name, content):
+    with timed('storage'):
+        return default_storage.save(name, ContentFile(content))
+
+
+def store_profile_image(data):
+    """
+    Normalizes an uploaded image and stores it together with its thumbnails.
+    Returns {'name': ..., 'variants': {size: name}}. Identical uploads are
+    processed and stored only once.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    key = f'profile_images:sha256:{digest}'
+
+    stored = cache.get(key)
+    if stored is not None:
+        return stored
+
+    image = load_image(data)
+    stored = {
+        'name': save_file(f'profile_images/{digest}.jpg', encode_image(image)),
+        'variants': {
+            str(size): save_file(f'profile_images/{digest}_{size}.jpg', encode_image(image, size))
+            for size in settings.PROFILE_IMAGE_VARIANT_SIZES
+        },
+    }
+    cache.set(key, stored, settings.PROFILE_IMAGE_CACHE_TIMEOUT)
+    return stored
+
+
+def attach_profile_image(user_id, stored, replace=True):
+    user = User.objects.only('id', 'profile_image', 'profile_image_variants').get(pk=user_id)
+    if user.profile_image and not replace:
+        return
+
+    user.profile_image = stored['name']
+    user.profile_image_variants = stored['variants']
+    user.save(update_fields=['profile_image', 'profile_image_variants'])
+
+
+def process_profile_image(user_id, data):
+    """
+    Background job for uploads from the registration and profile endpoints.
+    """
+    attach_profile_image(user_id, store_profile_image(data))
+
+
+def read_upload(upload):
+    upload.seek(0)
+    return upload.read()
@@ -0,0 +1,92 @@
+import copy
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.utils import load_backend
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the per-request database cost of a new connection per request, "
+        "persistent connections and the psycopg 3 pool (DB_POOL)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500,
+                            help="Simulated requests per mode.")
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--query', default='SELECT 1',
+                            help="Query run once per simulated request.")
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        if alias not in connections.settings:
+            raise CommandError(f"Unknown database '{alias}'.")
+        settings_dict = connections.settings[alias]
+
+        modes = [
+            ('new connection', {'CONN_MAX_AGE': 0}, False),
+            ('persistent', {'CONN_MAX_AGE': None, 'CONN_HEALTH_CHECKS': True}, False),
+        ]
+        if self.supports_pool(settings_dict):
+            modes.append(('pool', {'CONN_MAX_AGE': 0}, True))
+        else:
+            self.stdout.write("pool: skipped, needs Postgres with psycopg 3 (pip install '.[pool]')")
+
+        self.stdout.write(f"{'mode':<16}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+        for name, overrides, pool in modes:
+            connection = self.make_connection(alias, settings_dict, overrides, pool)
+            try:
+                timings = self.measure(connection, options['query'], options['requests'])
+            finally:
+                connection.close()
+                if pool:
+                    connection.close_pool()
+
+            timings.sort()
+            self.stdout.write(
+                f"{name:<16}{timings[len(timings) // 2] * 1000:>10.3f}"
+                f"{timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000:>10.3f}"
+                f"{statistics.mean(timings) * 1000:>10.3f}"
+            )
+
+    def supports_pool(self, settings_dict):
+        if settings_dict['ENGINE'] != 'django.db.backends.postgresql':
+            return False
+        from django.db.backends.postgresql.psycopg_any import is_psycopg3
+        if not is_psycopg3:
+            return False
+        try:
+            import psycopg_pool  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def make_connection(self, alias, settings_dict, overrides, pool):
+        # a private connection per mode, so the settings under test don't leak into the shared one
+        settings_dict = copy.deepcopy(settings_dict)
+        settings_dict.update(overrides)
+        options = settings_dict.setdefault('OPTIONS', {})
+        if pool:
+            options.setdefault('pool', True)
+        else:
+            options.pop('pool', None)
+        return load_backend(settings_dict['ENGINE']).DatabaseWrapper(settings_dict, alias)
+
+    def measure(self, connection, query, count):
+        """
+        Runs `count` request cycles: the connection checks done on request_started,
+        one query, then the cleanup done on request_finished.
+        """
+        timings = []
+        for _ in range(count):
+            started = time.perf_counter()
+            connection.close_if_unusable_or_obsolete()
+            with connection.cursor() as cursor:
+                cursor.execute(query)
+                cursor.fetchall()
+            connection.close_if_unusable_or_obsolete()
+            timings.append(time.perf_counter() - started)
+        return timings
@@ -0,0 +1,51 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.hashers import verify_password as _verify_password
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+
+class Command(BaseCommand):
+    help = "Measure password verifications (logins) per second per core at different PBKDF2 work factors."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, nargs='+',
+                            default=[260_000, 600_000, settings.PASSWORD_HASH_ITERATIONS],
+                            help="Work factors to compare.")
+        parser.add_argument('--workers', type=int, default=settings.PASSWORD_HASHING_WORKERS,
+                            help="Concurrent verifications, as in the hashing executor.")
+        parser.add_argument('--seconds', type=float, default=3.0,
+                            help="Time spent on each work factor.")
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        self.stdout.write(f"{'iterations':>12} {'ms/login':>10} {'logins/s/core':>14} {f'logins/s x{workers}':>16}")
+
+        for iterations in sorted(set(options['iterations'])):
+            with override_settings(PASSWORD_HASH_ITERATIONS=iterations):
+                encoded = make_password('benchmark-password')
+
+                single = self.measure(encoded, 1, options['seconds'])
+                pooled = self.measure(encoded, workers, options['seconds'])
+
+            self.stdout.write(
+                f"{iterations:>12} {1000 / single:>10.1f} {single:>14.1f} {pooled:>16.1f}"
+            )
+
+    def measure(self, encoded, workers, seconds):
+        deadline = time.monotonic() + seconds
+
+        def run():
+            count = 0
+            while time.monotonic() < deadline:
+                _verify_password('benchmark-password', encoded)
+                count += 1
+            return count
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            total = sum(executor.map(lambda _: run(), range(workers)))
+        return total / (time.monotonic() - started)
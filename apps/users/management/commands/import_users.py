@@ -0,0 +1,152 @@
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from users.groups import get_group_id
+from users.roles import ADMIN, STUDENT
+
+User = get_user_model()
+
+FIELDS = ['first_name', 'last_name', 'phone_number']
+
+
+def hash_passwords(passwords):
+    # runs in a worker process, an empty password gives an unusable one
+    return [make_password(password or None) for password in passwords]
+
+
+def parse_role(row):
+    return (row.get('role') or STUDENT).strip().capitalize()
+
+
+def read_rows(path, fmt):
+    # streamed, the input file is never loaded in memory as a whole
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+class Command(BaseCommand):
+    help = "Create users in bulk from a CSV or JSONL file (email, first_name, last_name, phone_number, password, role)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV file with a header row, or JSONL with one object per line.")
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help="Input format, guessed from the file extension by default.")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Users inserted per transaction.")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help="Processes used for password hashing.")
+        parser.add_argument('--inactive', action='store_true',
+                            help="Create the accounts inactive so they have to verify their email first.")
+        parser.add_argument('--checkpoint',
+                            help="File recording how many rows were imported (default: <path>.checkpoint).")
+        parser.add_argument('--resume', action='store_true',
+                            help="Skip the rows recorded in the checkpoint file.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+        checkpoint = options['checkpoint'] or f'{path}.checkpoint'
+        batch_size = options['batch_size']
+
+        done = 0
+        if options['resume'] and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                done = json.load(f)['rows']
+            self.stdout.write(f"Resuming after row {done}.")
+
+        groups = {name: get_group_id(name) for name in (ADMIN, STUDENT)}
+        # a bad row found halfway would leave a partial import behind
+        self.check_roles(islice(read_rows(path, fmt), done, None), groups, done)
+
+        rows = islice(read_rows(path, fmt), done, None)
+        created = skipped = 0
+        started = time.monotonic()
+
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as executor:
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+
+                batch_started = time.monotonic()
+                inserted = self.import_batch(batch, groups, executor, options)
+                created += inserted
+                skipped += len(batch) - inserted
+                done += len(batch)
+
+                with open(checkpoint, 'w') as f:
+                    json.dump({'rows': done}, f)
+
+                elapsed = time.monotonic() - batch_started
+                self.stdout.write(
+                    f"Row {done}: {inserted} created, {len(batch) - inserted} skipped "
+                    f"({len(batch) / elapsed:.0f} rows/s)"
+                )
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {created} user(s), skipped {skipped}, in {elapsed:.1f}s "
+            f"({(created + skipped) / elapsed if elapsed else 0:.0f} rows/s)."
+        ))
+
+    def check_roles(self, rows, groups, done):
+        for number, row in enumerate(rows, start=done + 1):
+            role = parse_role(row)
+            if role not in groups:
+                raise CommandError(f"Unknown role {role!r} in row {number}, nothing was imported.")
+
+    def import_batch(self, batch, groups, executor, options):
+        users = {}
+        for row in batch:
+            email = User.objects.normalize_email((row.get('email') or '').strip())
+            if not email or email in users:
+                continue
+
+            users[email] = (row, parse_role(row))
+
+        # existing accounts are left alone, this also makes re-running an import safe
+        existing = set(User.objects.filter(email__in=users.keys()).values_list('email', flat=True))
+        users = {email: value for email, value in users.items() if email not in existing}
+        if not users:
+            return 0
+
+        # hash in parallel, one chunk per worker process
+        passwords = [row.get('password') or '' for row, _ in users.values()]
+        size = -(-len(passwords) // options['workers'])
+        chunks = [passwords[i:i + size] for i in range(0, len(passwords), size)]
+        hashes = [encoded for chunk in executor.map(hash_passwords, chunks) for encoded in chunk]
+
+        objs = []
+        memberships = []
+        for (email, (row, role)), encoded in zip(users.items(), hashes):
+            user = User(
+                email=email,
+                password=encoded,
+                is_active=not options['inactive'],
+                is_staff=role == ADMIN,
+                **{field: row.get(field) or '' for field in FIELDS},
+            )
+            user.phone_number = user.phone_number or None
+            objs.append(user)
+            memberships.append(User.groups.through(user_id=user.pk, group_id=groups[role]))
+
+        with transaction.atomic():
+            User.objects.bulk_create(objs)
+            User.groups.through.objects.bulk_create(memberships)
+
+        return len(objs)
@@ -0,0 +1,110 @@
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# runs in a fresh interpreter, this process has long imported everything
+PROBE = '''
+import json
+import time
+
+started = time.perf_counter()
+import django
+from django.apps import AppConfig
+
+ready_times = []
+create = AppConfig.create.__func__
+
+
+def timed_create(cls, entry):
+    config = create(cls, entry)
+    ready = config.ready
+
+    def timed_ready():
+        ready_started = time.perf_counter()
+        ready()
+        ready_times.append((config.label, time.perf_counter() - ready_started))
+
+    config.ready = timed_ready
+    return config
+
+
+AppConfig.create = classmethod(timed_create)
+django.setup()
+setup = time.perf_counter() - started
+
+warmup = {}
+if WARMUP:
+    from users.warmup import warm
+    warmup = warm()
+
+print(json.dumps({'setup': setup, 'ready': ready_times, 'warmup': warmup}))
+'''
+
+
+class Command(BaseCommand):
+    help = (
+        "Report what a worker pays at boot: import time per package and module, "
+        "AppConfig.ready() per app and each users.warmup step."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=15,
+                            help="Packages and modules listed.")
+        parser.add_argument('--no-warmup', action='store_true',
+                            help="Only profile django.setup().")
+
+    def handle(self, *args, **options):
+        probe = PROBE.replace('WARMUP', str(not options['no_warmup']))
+        env = {**os.environ, 'WARMUP_ON_STARTUP': 'False'}
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', probe],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if result.returncode:
+            raise CommandError(f"Startup probe failed:\n{result.stderr[-2000:]}")
+
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+        imports = self.parse_importtime(result.stderr)
+        top = options['top']
+
+        self.stdout.write(f"django.setup(): {report['setup'] * 1000:.0f} ms, {len(imports)} modules imported\n")
+
+        packages = defaultdict(lambda: [0, 0])
+        for name, own, _ in imports:
+            package = packages[name.split('.')[0]]
+            package[0] += own
+            package[1] += 1
+        self.stdout.write(f"{'package':<32}{'import ms':>10}{'modules':>9}")
+        for name, (own, count) in sorted(packages.items(), key=lambda item: -item[1][0])[:top]:
+            self.stdout.write(f"{name:<32}{own / 1000:>10.1f}{count:>9}")
+
+        self.stdout.write(f"\n{'module':<48}{'self ms':>10}{'cumulative ms':>15}")
+        for name, own, cumulative in sorted(imports, key=lambda item: -item[2])[:top]:
+            self.stdout.write(f"{name:<48}{own / 1000:>10.1f}{cumulative / 1000:>15.1f}")
+
+        # ready() time includes the modules it imports, e.g. users.signals
+        self.stdout.write(f"\n{'ready()':<32}{'ms':>10}")
+        for label, seconds in sorted(report['ready'], key=lambda item: -item[1]):
+            self.stdout.write(f"{label:<32}{seconds * 1000:>10.1f}")
+
+        if report['warmup']:
+            self.stdout.write(f"\n{'warmup step':<32}{'ms':>10}")
+            for step, seconds in report['warmup'].items():
+                self.stdout.write(f"{step:<32}{seconds * 1000:>10.1f}")
+
+    def parse_importtime(self, output):
+        # "import time:       self [us] |  cumulative | imported package"
+        imports = []
+        for line in output.splitlines():
+            if not line.startswith('import time:'):
+                continue
+            own, cumulative, name = line[len('import time:'):].split('|')
+            if not own.strip().isdigit():
+                continue  # header
+            imports.append((name.strip(), int(own), int(cumulative)))
+        return imports
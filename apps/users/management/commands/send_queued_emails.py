@@ -0,0 +1,42 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from users.outbox import drain, queue_depth
+
+
+class Command(BaseCommand):
+    help = "Deliver queued emails from the outbox over a single reused SMTP connection."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.EMAIL_OUTBOX_BATCH_SIZE,
+                            help="Number of messages claimed per batch.")
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep polling the outbox instead of exiting once it is drained.")
+        parser.add_argument('--interval', type=float, default=settings.EMAIL_OUTBOX_POLL_INTERVAL,
+                            help="Seconds to sleep between polls in --loop mode.")
+        parser.add_argument('--depth', action='store_true',
+                            help="Only print the number of messages waiting to be sent.")
+
+    def handle(self, *args, **options):
+        if options['depth']:
+            self.stdout.write(str(queue_depth()))
+            return
+
+        while True:
+            try:
+                sent, failed = drain(options['batch_size'])
+            except Exception as e:
+                # SMTP server unreachable, nothing was marked as sent so just try again later
+                if not options['loop']:
+                    raise
+                self.stderr.write(f"Outbox delivery failed: {e}")
+                sent = failed = 0
+
+            if sent or failed:
+                self.stdout.write(f"Sent {sent} email(s), {failed} failed.")
+
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,97 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from users.models import EmailOutbox, OneTimePassword, RevokedToken
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired one time passwords, accounts that were never verified, "
+        "revoked tokens that have expired and old outbox messages, in small chunks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--otp-max-age', type=int, default=settings.OTP_TTL,
+                            help="Seconds after which a one time password is expired.")
+        parser.add_argument('--unverified-days', type=int, default=settings.UNVERIFIED_ACCOUNT_TTL_DAYS,
+                            help="Days after which a never verified account is deleted.")
+        parser.add_argument('--outbox-days', type=int, default=settings.EMAIL_OUTBOX_RETENTION_DAYS,
+                            help="Days after which a sent or failed outbox message is deleted.")
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help="Rows deleted per transaction.")
+        parser.add_argument('--sleep', type=float, default=0.1,
+                            help="Seconds to pause between chunks, limits the load on the database.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only count what would be deleted.")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+
+        otp_cutoff = now - timedelta(seconds=options['otp_max_age'])
+        expired_otps = OneTimePassword.objects.filter(created_at__lt=otp_cutoff)
+        count = self.sweep(expired_otps, 'created_at', options)
+        self.stdout.write(f"{'Would delete' if options['dry_run'] else 'Deleted'} {count} expired OTP(s).")
+
+        account_cutoff = now - timedelta(days=options['unverified_days'])
+        unverified = User.objects.filter(
+            is_active=False,
+            last_login__isnull=True,  # deactivated accounts that were once used are kept
+            is_staff=False,
+            is_superuser=False,
+            date_joined__lt=account_cutoff,
+        )
+        count = self.sweep(unverified, 'date_joined', options)
+        self.stdout.write(f"{'Would delete' if options['dry_run'] else 'Deleted'} {count} unverified account(s).")
+
+        # an expired token is rejected anyway, its revocation is no longer needed
+        expired_revocations = RevokedToken.objects.filter(expires_at__lt=now)
+        count = self.sweep(expired_revocations, 'expires_at', options)
+        self.stdout.write(f"{'Would delete' if options['dry_run'] else 'Deleted'} {count} expired revoked token(s).")
+
+        # pending messages are kept whatever their age, the worker still owes them
+        outbox_cutoff = now - timedelta(days=options['outbox_days'])
+        delivered = EmailOutbox.objects.filter(
+            status__in=[EmailOutbox.STATUS_SENT, EmailOutbox.STATUS_FAILED],
+            created_at__lt=outbox_cutoff,
+        )
+        count = self.sweep(delivered, 'id', options)
+        self.stdout.write(f"{'Would delete' if options['dry_run'] else 'Deleted'} {count} outbox message(s).")
+
+    def sweep(self, queryset, order_field, options):
+        """
+        Walks the queryset in (order_field, pk) order with a keyset cursor instead of
+        OFFSET, so every chunk is an index range scan that starts where the last one ended.
+        """
+        total = 0
+        last = None
+
+        while True:
+            chunk = queryset.order_by(order_field, 'pk')
+            if last is not None:
+                chunk = chunk.filter(
+                    Q(**{f'{order_field}__gt': last[0]}) | Q(**{order_field: last[0], 'pk__gt': last[1]})
+                )
+            rows = list(chunk.values_list(order_field, 'pk')[:options['chunk_size']])
+            if not rows:
+                break
+            last = rows[-1]
+
+            if options['dry_run']:
+                total += len(rows)
+            else:
+                with transaction.atomic():
+                    # re-apply the filter, a row may have changed since it was read
+                    _, deleted = queryset.filter(pk__in=[pk for _, pk in rows]).delete()
+                total += deleted.get(queryset.model._meta.label, 0)
+                time.sleep(options['sleep'])
+
+        return total
@@ -0,0 +1,117 @@
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics, routers, timing
+
+logger = logging.getLogger(__name__)
+
+
+class ServerTimingMiddleware:
+    """
+    Reports where a request spent its time (queries, hashing, outbound I/O) in a
+    Server-Timing header, and logs sampled requests slower than
+    SLOW_REQUEST_THRESHOLD_MS together with their slowest queries.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        timings, token = timing.start(self.sample())
+        try:
+            response = self.get_response(request)
+        finally:
+            timing.stop(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings, token = timing.start(self.sample())
+        try:
+            response = await self.get_response(request)
+        finally:
+            timing.stop(token)
+        return self.finish(request, response, timings)
+
+    def sample(self):
+        return random.random() < settings.SLOW_REQUEST_SAMPLE_RATE
+
+    def finish(self, request, response, timings):
+        metrics.observe_request(request, response, timings.elapsed())
+        if settings.SERVER_TIMING_HEADER:
+            response['Server-Timing'] = timings.header()
+
+        elapsed_ms = timings.elapsed() * 1000
+        if timings.queries is not None and elapsed_ms >= settings.SLOW_REQUEST_THRESHOLD_MS:
+            top = timings.top_queries(settings.SLOW_REQUEST_TOP_QUERIES)
+            logger.warning(
+                "Slow request %s %s -> %s in %.0fms (%s)%s",
+                request.method, request.path, response.status_code, elapsed_ms, timings.header(),
+                ''.join(f'\n  {seconds * 1000:.1f}ms {sql}' for seconds, sql in top),
+            )
+        return response
+
+
+class ReplicaPinMiddleware:
+    """
+    Read-your-writes for replica routing: unsafe requests use the primary
+    throughout, and a client that wrote gets a cookie keeping its reads on the
+    primary for REPLICA_STICKY_SECONDS, until the replicas have caught up.
+    """
+    sync_capable = True
+    async_capable = True
+    safe_methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        tokens = routers.start_request(self.pinned(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = routers.end_request(tokens)
+        return self.finish(request, response, wrote)
+
+    async def __acall__(self, request):
+        tokens = routers.start_request(self.pinned(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            wrote = routers.end_request(tokens)
+        return self.finish(request, response, wrote)
+
+    def pinned(self, request):
+        if request.method not in self.safe_methods:
+            return True
+        try:
+            return float(request.COOKIES.get(settings.REPLICA_PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def finish(self, request, response, wrote):
+        if wrote:
+            response.set_cookie(
+                settings.REPLICA_PIN_COOKIE,
+                str(int(time.time()) + settings.REPLICA_STICKY_SECONDS),
+                max_age=settings.REPLICA_STICKY_SECONDS,
+                secure=request.is_secure(),
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.9 on 2026-10-18 16:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0005_user_profile_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='onetimepassword',
+            index=models.Index(fields=['created_at'], name='otp_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['is_active', 'date_joined'], name='user_active_joined_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.9 on 2026-10-18 16:20
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_onetimepassword_otp_created_at_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.CharField(choices=[('login', 'Login'), ('login_failed', 'Failed login'), ('refresh', 'Token refresh'), ('otp_verified', 'OTP verified'), ('otp_failed', 'Wrong OTP')], max_length=16)),
+                ('ip_address', models.GenericIPAddressField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='auth_events', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'created_at'], name='authevent_user_created_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+ROLE_GROUPS = ['Admin', 'Student']
+
+
+def seed_role_groups(apps, schema_editor):
+    Group = apps.get_model('auth', 'Group')
+    for name in ROLE_GROUPS:
+        Group.objects.get_or_create(name=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0009_user_directory_indexes'),
+    ]
+
+    operations = [
+        # the groups may already have members, so they are left in place on reverse
+        migrations.RunPython(seed_role_groups, migrations.RunPython.noop),
+    ]
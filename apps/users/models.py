@@ -1,7 +1,11 @@
 import uuid
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 
+from .hashing import ahash_password, averify_password, hash_password, upgrade_password_hash, verify_password
+from .tasks import run_in_background, submit
+
 class CustomUserManager(BaseUserManager):
     def create_user(self, email, password=None, **extra_fields):
         if not email:
@@ -12,6 +16,16 @@ class CustomUserManager(BaseUserManager):
         user.save(using=self._db)
         return user
 
+    async def acreate_user(self, email, password=None, **extra_fields):
+        if not email:
+            raise ValueError("The email field is required.")
+        email = self.normalize_email(email)
+        user = self.model(email=email, **extra_fields)
+        user.password = await ahash_password(password)
+        user._password = password
+        await user.asave(using=self._db)
+        return user
+
     def create_superuser(self, email, password=None, **extra_fields):
         extra_fields.setdefault('is_staff', True)
         extra_fields.setdefault('is_superuser', True)
@@ -32,12 +46,63 @@ class User(AbstractUser):
     last_name = models.CharField('last name', max_length=255, blank=True)
     phone_number = models.CharField(max_length=15, blank=True, null=True)
     profile_image = models.ImageField(upload_to='profile_images/', blank=True, null=True)
+    # stored thumbnail names keyed by size, filled in by users.images
+    profile_image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # bumped to revoke every JWT issued so far (see users.authentication)
+    token_version = models.PositiveIntegerField(default=0, editable=False)
 
     USERNAME_FIELD = 'email' 
     REQUIRED_FIELDS = []
 
     objects = CustomUserManager()
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # never-verified accounts are swept by `manage.py sweep_stale_data`
+            models.Index(fields=['is_active', 'date_joined'], name='user_active_joined_idx'),
+            # keyset pagination of the admin user directory
+            models.Index(fields=['date_joined', 'id'], name='user_joined_id_idx'),
+        ]
     
+    # is_active as read from the database, see users.signals.revoke_tokens_on_deactivation
+    # (None when it wasn't loaded)
+    _loaded_is_active = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_is_active = instance.__dict__.get('is_active')
+        return instance
+
+    # hashing runs on the bounded executor from users.hashing, and hash upgrades
+    # happen in the background instead of an extra UPDATE during login
+
+    def set_password(self, raw_password):
+        """
+        Hashes on the executor from users.hashing. The calling thread waits for
+        the result, so this only caps how many hashes run at once, it doesn't
+        free the thread; async code uses ahash_password().
+        """
+        self.password = hash_password(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        """
+        Like set_password(), blocks the calling thread until the executor has
+        verified the password; async code uses acheck_password().
+        """
+        is_correct, must_update = verify_password(raw_password, self.password)
+        if is_correct and must_update:
+            run_in_background(upgrade_password_hash, self.pk, self.password, raw_password)
+        return is_correct
+
+    async def acheck_password(self, raw_password):
+        is_correct, must_update = await averify_password(raw_password, self.password)
+        if is_correct and must_update:
+            # async callers can't register on_commit hooks, the login itself wrote nothing anyway
+            submit(upgrade_password_hash, self.pk, self.password, raw_password)
+        return is_correct
+
     @property
     def full_name(self):
         return f"{self.first_name} {self.last_name}".strip()
@@ -51,5 +116,91 @@ class OneTimePassword(models.Model):
     otp = models.CharField(max_length=5) 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='otp_created_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.email} - {self.otp}"
+
+
+class EmailOutbox(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255, blank=True)
+    to = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name_plural = 'email outbox'
+        indexes = [
+            # the worker only ever scans pending rows that are due
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.to)} ({self.status})"
+
+
+class AuthEvent(models.Model):
+    # written in batches by users.auth_events
+    LOGIN = 'login'
+    LOGIN_FAILED = 'login_failed'
+    REFRESH = 'refresh'
+    OTP_VERIFIED = 'otp_verified'
+    OTP_FAILED = 'otp_failed'
+    EVENT_CHOICES = [
+        (LOGIN, 'Login'),
+        (LOGIN_FAILED, 'Failed login'),
+        (REFRESH, 'Token refresh'),
+        (OTP_VERIFIED, 'OTP verified'),
+        (OTP_FAILED, 'Wrong OTP'),
+    ]
+
+    # empty for failed logins with an unknown email
+    user = models.ForeignKey(User, on_delete=models.CASCADE, blank=True, null=True, related_name='auth_events')
+    event = models.CharField(max_length=16, choices=EVENT_CHOICES)
+    ip_address = models.GenericIPAddressField(blank=True, null=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='authevent_user_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.event} {self.user_id or '-'} at {self.created_at}"
+
+
+class RevokedToken(models.Model):
+    # JTIs of logged out tokens, checked through the per-process Bloom filter in users.revocation
+    jti = models.CharField(max_length=255, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, blank=True, null=True, related_name='revoked_tokens')
+    # the row is useless once the token has expired, `manage.py sweep_stale_data` deletes it
+    expires_at = models.DateTimeField()
+    revoked_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['expires_at'], name='revokedtoken_expires_idx'),
+            # the filters load the rows revoked since their last sync
+            models.Index(fields=['revoked_at'], name='revokedtoken_revoked_idx'),
+        ]
+
     def __str__(self):
-        return f"{self.user.email} - {self.otp}"
\ No newline at end of file
+        return f"{self.jti} (expires {self.expires_at})"
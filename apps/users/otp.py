@@ -0,0 +1,175 @@
+import secrets
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.module_loading import import_string
+
+from .models import OneTimePassword
+
+# results of BaseOTPBackend.verify()
+OTP_VALID = 'valid'
+OTP_INVALID = 'invalid'
+OTP_EXPIRED = 'expired'
+OTP_MISSING = 'missing'
+
+_backend = None
+
+
+def get_otp_backend():
+    global _backend
+    if _backend is None:
+        _backend = import_string(settings.OTP_BACKEND)()
+    return _backend
+
+
+class BaseOTPBackend:
+    def generate_code(self):
+        return str(10000 + secrets.randbelow(90000))  # 5 digits
+
+    def issue(self, user):
+        """
+        Creates a new code for the user, replacing any previous one, and returns it.
+        """
+        raise NotImplementedError
+
+    def verify(self, user, otp):
+        """
+        Checks the code and consumes it when it matches. Returns one of the OTP_* results.
+        """
+        raise NotImplementedError
+
+    async def aissue(self, user):
+        raise NotImplementedError
+
+    async def averify(self, user, otp):
+        raise NotImplementedError
+
+
+class DatabaseOTPBackend(BaseOTPBackend):
+    """
+    Stores codes in the OneTimePassword table, one row per user.
+    """
+
+    def issue(self, user):
+        otp_code = self.generate_code()
+        OneTimePassword.objects.update_or_create(
+            user=user,
+            defaults={'otp': otp_code, 'created_at': timezone.now()}
+        )
+        return otp_code
+
+    def verify(self, user, otp):
+        try:
+            user_otp = OneTimePassword.objects.get(user=user)
+        except OneTimePassword.DoesNotExist:
+            return OTP_MISSING
+
+        if user_otp.created_at < timezone.now() - timedelta(seconds=settings.OTP_TTL):
+            user_otp.delete() # auto-remove expired OTP
+            return OTP_EXPIRED
+
+        if not constant_time_compare(user_otp.otp, otp):
+            return OTP_INVALID
+
+        # only the request that actually deletes the row gets to use the code
+        deleted, _ = OneTimePassword.objects.filter(pk=user_otp.pk).delete()
+        return OTP_VALID if deleted else OTP_MISSING
+
+    async def aissue(self, user):
+        otp_code = self.generate_code()
+        await OneTimePassword.objects.aupdate_or_create(
+            user=user,
+            defaults={'otp': otp_code, 'created_at': timezone.now()}
+        )
+        return otp_code
+
+    async def averify(self, user, otp):
+        try:
+            user_otp = await OneTimePassword.objects.aget(user=user)
+        except OneTimePassword.DoesNotExist:
+            return OTP_MISSING
+
+        if user_otp.created_at < timezone.now() - timedelta(seconds=settings.OTP_TTL):
+            await user_otp.adelete()
+            return OTP_EXPIRED
+
+        if not constant_time_compare(user_otp.otp, otp):
+            return OTP_INVALID
+
+        deleted, _ = await OneTimePassword.objects.filter(pk=user_otp.pk).adelete()
+        return OTP_VALID if deleted else OTP_MISSING
+
+
+class CacheOTPBackend(BaseOTPBackend):
+    """
+    Stores codes in the default cache with a native TTL, so expired codes
+    never need cleaning up. Needs a cache shared by all app nodes (CACHE_URL).
+    """
+
+    def _keys(self, user):
+        return f'users:otp:{user.pk}', f'users:otp:attempts:{user.pk}'
+
+    def issue(self, user):
+        otp_code = self.generate_code()
+        code_key, attempts_key = self._keys(user)
+        cache.set_many({code_key: otp_code, attempts_key: 0}, settings.OTP_TTL)
+        return otp_code
+
+    def verify(self, user, otp):
+        code_key, attempts_key = self._keys(user)
+
+        try:
+            attempts = cache.incr(attempts_key)
+        except ValueError:
+            # expired or never issued
+            return OTP_MISSING
+
+        if attempts > settings.OTP_MAX_ATTEMPTS:
+            cache.delete_many([code_key, attempts_key])
+            return OTP_MISSING
+
+        otp_code = cache.get(code_key)
+        if otp_code is None:
+            return OTP_MISSING
+
+        if not constant_time_compare(otp_code, otp):
+            return OTP_INVALID
+
+        # delete() reports whether the key was there, so a code can't be used twice
+        if not cache.delete(code_key):
+            return OTP_MISSING
+        cache.delete(attempts_key)
+        return OTP_VALID
+
+    async def aissue(self, user):
+        otp_code = self.generate_code()
+        code_key, attempts_key = self._keys(user)
+        await cache.aset_many({code_key: otp_code, attempts_key: 0}, settings.OTP_TTL)
+        return otp_code
+
+    async def averify(self, user, otp):
+        code_key, attempts_key = self._keys(user)
+
+        try:
+            attempts = await cache.aincr(attempts_key)
+        except ValueError:
+            return OTP_MISSING
+
+        if attempts > settings.OTP_MAX_ATTEMPTS:
+            await cache.adelete_many([code_key, attempts_key])
+            return OTP_MISSING
+
+        otp_code = await cache.aget(code_key)
+        if otp_code is None:
+            return OTP_MISSING
+
+        if not constant_time_compare(otp_code, otp):
+            return OTP_INVALID
+
+        if not await cache.adelete(code_key):
+            return OTP_MISSING
+        await cache.adelete(attempts_key)
+        return OTP_VALID
@@ -0,0 +1,139 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import EmailOutbox
+from .metrics import EMAIL_SEND_SECONDS
+from .timing import timed
+
+
+def queue_email(subject, body, to, from_email=None):
+    # a single insert, the delivery worker picks it up from here
+    return EmailOutbox.objects.create(
+        subject=subject,
+        body=body,
+        from_email=from_email or settings.EMAIL_HOST_USER,
+        to=list(to),
+    )
+
+
+async def aqueue_email(subject, body, to, from_email=None):
+    return await EmailOutbox.objects.acreate(
+        subject=subject,
+        body=body,
+        from_email=from_email or settings.EMAIL_HOST_USER,
+        to=list(to),
+    )
+
+
+def queue_depth():
+    # number of messages due for delivery right now
+    return EmailOutbox.objects.filter(
+        status=EmailOutbox.STATUS_PENDING,
+        next_attempt_at__lte=timezone.now(),
+    ).count()
+
+
+def retry_delay(attempts):
+    # exponential backoff: base, 2x base, 4x base ... capped
+    base = settings.EMAIL_OUTBOX_RETRY_BACKOFF
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), settings.EMAIL_OUTBOX_MAX_BACKOFF))
+
+
+def claim_batch(batch_size):
+    # lock the due rows so that concurrent workers never pick up the same message
+    with transaction.atomic():
+        rows = list(
+            EmailOutbox.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=EmailOutbox.STATUS_PENDING, next_attempt_at__lte=timezone.now())
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        # push the claimed rows out of the due window while they are being sent
+        EmailOutbox.objects.filter(pk__in=[row.pk for row in rows]).update(
+            next_attempt_at=timezone.now() + timedelta(seconds=settings.EMAIL_OUTBOX_CLAIM_TIMEOUT)
+        )
+    return rows
+
+
+def release(pks):
+    # hands claimed rows back before EMAIL_OUTBOX_CLAIM_TIMEOUT
+    EmailOutbox.objects.filter(pk__in=pks, status=EmailOutbox.STATUS_PENDING).update(
+        next_attempt_at=timezone.now()
+    )
+
+
+def deliver_batch(connection, batch_size):
+    """
+    Sends one batch of due messages over an already opened connection.
+    Returns a (sent, failed) tuple. Raises if the connection can't be
+    reopened after a failure, the unsent rest of the batch is released.
+    """
+    rows = claim_batch(batch_size)
+    sent = failed = 0
+
+    for index, row in enumerate(rows):
+        message = EmailMessage(
+            subject=row.subject,
+            body=row.body,
+            from_email=row.from_email or None,
+            to=row.to,
+            connection=connection,
+        )
+        row.attempts += 1
+        try:
+            with timed('email'), EMAIL_SEND_SECONDS.time():
+                connection.send_messages([message])
+        except Exception as e:
+            failed += 1
+            row.last_error = str(e)
+            if row.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+                row.status = EmailOutbox.STATUS_FAILED
+                row.body = ''
+            else:
+                row.next_attempt_at = timezone.now() + retry_delay(row.attempts)
+            row.save(update_fields=['attempts', 'status', 'next_attempt_at', 'last_error', 'body'])
+            # the SMTP session may be unusable after an error, start a fresh one
+            try:
+                connection.close()
+                connection.open()
+            except Exception:
+                # the server is gone, the rest of the batch is due again right away
+                release([other.pk for other in rows[index + 1:]])
+                raise
+            continue
+
+        sent += 1
+        row.status = EmailOutbox.STATUS_SENT
+        row.sent_at = timezone.now()
+        row.last_error = ''
+        # bodies hold one time passwords, they are not kept once the message is done with
+        row.body = ''
+        row.save(update_fields=['attempts', 'status', 'sent_at', 'last_error', 'body'])
+
+    return sent, failed
+
+
+def drain(batch_size=None):
+    """
+    Delivers every due message, reusing one connection for all batches.
+    """
+    batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+    total_sent = total_failed = 0
+
+    connection = get_connection(fail_silently=False)
+    connection.open()
+    try:
+        while True:
+            sent, failed = deliver_batch(connection, batch_size)
+            total_sent += sent
+            total_failed += failed
+            if sent + failed < batch_size:
+                break
+    finally:
+        connection.close()
+
+    return total_sent, total_failed
@@ -1,11 +1,13 @@
 from rest_framework import permissions
 
+from .roles import ADMIN, STUDENT, in_group
+
 class IsAdminGroup(permissions.BasePermission):
     def has_permission(self, request, view):
-        return request.user.is_authenticated and request.user.groups.filter(name='Admin').exists()
+        return request.user.is_authenticated and in_group(request.user, ADMIN)
     
 
 class IsStudentGroup(permissions.BasePermission):
     def has_permission(self, request, view):
-        return request.user.is_authenticated and request.user.groups.filter(name='Student').exists()
+        return request.user.is_authenticated and in_group(request.user, STUDENT)
     
\ No newline at end of file
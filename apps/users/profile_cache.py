@@ -0,0 +1,128 @@
+"""
+Cached representations of GET /auth/profile/ with ETag / Last-Modified support.
+
+Every user has a version number in the cache and representations are stored
+under it. Invalidating drops the version, the next read starts a new one, so a
+representation built from data read before a change is never served after it.
+
+The public profiles of GET /auth/users/batch/ are cached per user as well and
+dropped by the same invalidation.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from rest_framework.renderers import JSONRenderer
+
+from .caching import delete_on_commit
+from .routers import primary
+
+
+def _version_key(user_id):
+    return f'users:profile_version:{user_id}'
+
+
+def _representation_key(request, user_id, version):
+    # the image urls in the representation are absolute, so it is cached per host
+    base = hashlib.md5(request.build_absolute_uri('/').encode()).hexdigest()[:12]
+    return f'users:profile:{user_id}:{version}:{base}'
+
+
+def _new_version():
+    # time based, so a version evicted from the cache is never handed out again
+    return time.time_ns() // 1000
+
+
+def _build(data):
+    return {
+        'data': data,
+        'etag': '"%s"' % hashlib.sha256(JSONRenderer().render(data)).hexdigest()[:32],
+        'last_modified': int(time.time()),
+    }
+
+
+def get_profile_representation(request, user_id, serialize):
+    """
+    Returns {'data', 'etag', 'last_modified'} for the user's profile, calling
+    serialize() only when the current version isn't cached yet.
+    """
+    version_key = _version_key(user_id)
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, _new_version(), settings.PROFILE_CACHE_TIMEOUT)
+        version = cache.get(version_key)
+
+    key = _representation_key(request, user_id, version)
+    entry = cache.get(key)
+    if entry is None:
+        # read from the primary, see users.routers
+        with primary():
+            entry = _build(serialize())
+        cache.set(key, entry, settings.PROFILE_CACHE_TIMEOUT)
+    return entry
+
+
+async def aget_profile_representation(request, user_id, serialize):
+    version_key = _version_key(user_id)
+    version = await cache.aget(version_key)
+    if version is None:
+        await cache.aadd(version_key, _new_version(), settings.PROFILE_CACHE_TIMEOUT)
+        version = await cache.aget(version_key)
+
+    key = _representation_key(request, user_id, version)
+    entry = await cache.aget(key)
+    if entry is None:
+        with primary():
+            entry = _build(await serialize())
+        await cache.aset(key, entry, settings.PROFILE_CACHE_TIMEOUT)
+    return entry
+
+
+def _public_key(user_id):
+    return f'users:public_profile:{user_id}'
+
+
+def get_public_profiles(user_ids, load):
+    """
+    Returns {user id: public profile} in one cache round trip, calling
+    load(missing ids) -> {user id: public profile} for the ones not cached.
+    Users load() leaves out (unknown, inactive) are left out of the result.
+    """
+    keys = {_public_key(user_id): user_id for user_id in user_ids}
+    profiles = {keys[key]: data for key, data in cache.get_many(list(keys)).items()}
+
+    missing = [user_id for user_id in user_ids if user_id not in profiles]
+    if missing:
+        with primary():
+            loaded = load(missing)
+        cache.set_many(
+            {_public_key(user_id): data for user_id, data in loaded.items()}, settings.PROFILE_CACHE_TIMEOUT
+        )
+        profiles.update(loaded)
+    return profiles
+
+
+def is_not_modified(request, entry):
+    # If-None-Match wins over If-Modified-Since (RFC 9110 13.2.2), weak comparison for GET
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = [etag.removeprefix('W/') for etag in parse_etags(if_none_match)]
+        return '*' in etags or entry['etag'] in etags
+
+    since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE') or '')
+    return since is not None and entry['last_modified'] <= since
+
+
+def cache_headers(entry):
+    return {
+        'ETag': entry['etag'],
+        'Last-Modified': http_date(entry['last_modified']),
+        # may be stored by the client, but has to be revalidated on every use
+        'Cache-Control': 'private, no-cache',
+    }
+
+
+def invalidate_profiles(user_ids):
+    delete_on_commit([key for user_id in user_ids for key in (_version_key(user_id), _public_key(user_id))])
@@ -0,0 +1,132 @@
+"""
+Token revocation (logout). Revoked JTIs are stored in RevokedToken and every
+process keeps a Bloom filter of them, so checking a token that was never
+revoked - nearly every request - costs no query. Only filter hits are
+confirmed against the table.
+
+The filter picks up rows revoked on other nodes every REVOCATION_SYNC_INTERVAL
+seconds and is rebuilt every REVOCATION_REBUILD_INTERVAL seconds to forget
+expired tokens.
+"""
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import RevokedToken
+
+# rows committed late (long transactions, clock skew between nodes) are still picked up
+SYNC_LOOKBACK = timedelta(seconds=60)
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        # double hashing, k positions out of one digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+_lock = threading.Lock()
+_filter = None
+_synced_at = None  # wall clock time of the last sync, rows revoked after it are loaded next
+_next_sync = 0.0
+_next_rebuild = 0.0
+
+
+def _sync_due():
+    return time.monotonic() >= _next_sync
+
+
+def sync(rebuild=False):
+    """
+    Brings this process' filter up to date with the table.
+    """
+    global _filter, _synced_at, _next_sync, _next_rebuild
+
+    now = timezone.now()
+    if rebuild or _filter is None or time.monotonic() >= _next_rebuild:
+        jtis = list(RevokedToken.objects.filter(expires_at__gt=now).values_list('jti', flat=True))
+        bloom = BloomFilter(max(settings.REVOCATION_BLOOM_CAPACITY, 2 * len(jtis)), settings.REVOCATION_BLOOM_ERROR_RATE)
+        _next_rebuild = time.monotonic() + settings.REVOCATION_REBUILD_INTERVAL
+    else:
+        jtis = RevokedToken.objects.filter(revoked_at__gte=_synced_at - SYNC_LOOKBACK).values_list('jti', flat=True)
+        bloom = _filter
+
+    for jti in jtis:
+        bloom.add(jti)
+    _filter, _synced_at = bloom, now
+    _next_sync = time.monotonic() + settings.REVOCATION_SYNC_INTERVAL
+
+
+def _might_be_revoked(jti):
+    # only one thread syncs, the others keep using the current filter meanwhile
+    # (and ask the table directly while there is no filter yet)
+    return _filter is None or jti in _filter
+
+
+def is_revoked(jti):
+    if not jti:
+        return False
+    if _sync_due() and _lock.acquire(blocking=False):
+        try:
+            sync()
+        finally:
+            _lock.release()
+    if not _might_be_revoked(jti):
+        return False
+    return RevokedToken.objects.filter(jti=jti).exists()
+
+
+async def ais_revoked(jti):
+    if not jti:
+        return False
+    if _sync_due() and _lock.acquire(blocking=False):
+        try:
+            await sync_to_async(sync)()
+        finally:
+            _lock.release()
+    if not _might_be_revoked(jti):
+        return False
+    return await RevokedToken.objects.filter(jti=jti).aexists()
+
+
+def revoke_tokens(tokens):
+    """
+    Revokes validated simplejwt tokens (access or refresh) until they expire.
+    """
+    rows = [
+        RevokedToken(
+            jti=token[api_settings.JTI_CLAIM],
+            user_id=token.get(api_settings.USER_ID_CLAIM),
+            expires_at=datetime.fromtimestamp(token['exp'], tz=dt_timezone.utc),
+        )
+        for token in tokens
+        if token is not None and token.get(api_settings.JTI_CLAIM)
+    ]
+    RevokedToken.objects.bulk_create(rows, ignore_conflicts=True)
+
+    # effective on this node right away, the other nodes see it on their next sync
+    if _filter is not None:
+        for row in rows:
+            _filter.add(row.jti)
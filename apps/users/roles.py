@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+
+from .caching import delete_on_commit
+from .routers import primary
+
+ADMIN = 'Admin'
+STUDENT = 'Student'
+
+# role reported for users that do not belong to any group
+DEFAULT_ROLE = STUDENT
+
+
+def _cache_key(user_id):
+    return f'users:groups:{user_id}'
+
+
+def get_user_groups(user):
+    """
+    Returns the user's group names ordered by group id.
+
+    Resolved once per user object (request.user lives as long as the request),
+    then from the shared cache, and only falls back to a query on a cache miss.
+    """
+    names = getattr(user, '_group_names', None)
+    if names is not None:
+        return names
+
+    prefetched = getattr(user, '_prefetched_objects_cache', {}).get('groups')
+    if prefetched is not None:
+        names = tuple(group.name for group in sorted(prefetched, key=lambda group: group.pk))
+    else:
+        key = _cache_key(user.pk)
+        names = cache.get(key)
+        if names is None:
+            with primary():
+                names = tuple(
+                    Group.objects.filter(user=user.pk).order_by('pk').values_list('name', flat=True)
+                )
+            cache.set(key, names, settings.USER_ROLE_CACHE_TIMEOUT)
+
+    user._group_names = names
+    return names
+
+
+async def aget_user_groups(user):
+    # async version of get_user_groups(), afterwards get_role/in_group are served from the memo
+    names = getattr(user, '_group_names', None)
+    if names is not None:
+        return names
+
+    key = _cache_key(user.pk)
+    names = await cache.aget(key)
+    if names is None:
+        with primary():
+            names = tuple([
+                name async for name in
+                Group.objects.filter(user=user.pk).order_by('pk').values_list('name', flat=True)
+            ])
+        await cache.aset(key, names, settings.USER_ROLE_CACHE_TIMEOUT)
+
+    user._group_names = names
+    return names
+
+
+def get_role(user):
+    # the first group is used as the role, handles users in multiple groups or none
+    names = get_user_groups(user)
+    return names[0] if names else DEFAULT_ROLE
+
+
+def in_group(user, name):
+    return name in get_user_groups(user)
+
+
+def invalidate_user_groups(user_ids):
+    delete_on_commit([_cache_key(user_id) for user_id in user_ids])
@@ -0,0 +1,93 @@
+"""
+Primary / replica routing (DATABASE_REPLICA_URLS).
+
+Writes go to the primary ('default') and reads to a random replica, except
+where a replica that is a few seconds behind would return the wrong answer.
+These reads go to the primary too:
+- everything in a request with an unsafe method (POST, PUT, PATCH, DELETE),
+  so it reads what it is about to write
+- reads after a write in the same request or background task, and inside a
+  transaction on the primary. Other threads (flushers, workers, commands)
+  are never pinned, a long-lived thread would stay on the primary for good,
+  they use primary() where a read has to see a write
+- a client's requests for REPLICA_STICKY_SECONDS after it wrote, through a
+  cookie set by ReplicaPinMiddleware
+- reads that fill a shared cache (primary()), otherwise pre-write data from a
+  replica would be served from the cache until its next invalidation
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_pinned = ContextVar('users_db_pinned', default=False)
+_wrote = ContextVar('users_db_wrote', default=False)
+# set between start_request() and end_request()
+_scoped = ContextVar('users_db_scoped', default=False)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas or _pinned.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        # the rest of the request or task reads its own writes
+        if _scoped.get():
+            _pinned.set(True)
+            _wrote.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get the schema through replication
+        return db == DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def primary():
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+def from_primary(instance):
+    # reloads an instance read from a replica, before it goes into a shared cache
+    if instance._state.db not in (None, DEFAULT_DB_ALIAS):
+        instance.refresh_from_db(using=DEFAULT_DB_ALIAS)
+    return instance
+
+
+async def afrom_primary(instance):
+    if instance._state.db not in (None, DEFAULT_DB_ALIAS):
+        await instance.arefresh_from_db(using=DEFAULT_DB_ALIAS)
+    return instance
+
+
+def start_request(pinned):
+    """
+    Starts a request or background task, writes pin its reads to the primary
+    until end_request().
+    """
+    return _pinned.set(pinned), _wrote.set(False), _scoped.set(True)
+
+
+def end_request(tokens):
+    """
+    Returns whether the request wrote to the primary.
+    """
+    wrote = _wrote.get()
+    pinned_token, wrote_token, scoped_token = tokens
+    _scoped.reset(scoped_token)
+    _wrote.reset(wrote_token)
+    _pinned.reset(pinned_token)
+    return wrote
@@ -1,14 +1,25 @@
-from django.utils import timezone
-from datetime import timedelta
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
 from rest_framework.exceptions import AuthenticationFailed
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import RefreshToken
 from django.conf import settings
-from django.contrib.auth.models import Group, update_last_login
+from django.contrib.auth.models import Group
 
 from .utils import send_otp_via_email
-from .models import OneTimePassword
+from .otp import OTP_EXPIRED, OTP_INVALID, OTP_MISSING, get_otp_backend
+from .roles import ADMIN, STUDENT, get_role, get_user_groups
+from .groups import add_to_group
+from .images import process_profile_image, read_upload
+from .tasks import run_in_background
+from . import bulk
+from .auth_events import record_event, record_login, record_otp_check
+from .models import AuthEvent
+from .authentication import (
+    TOKEN_VERSION_CLAIM, bump_token_version, check_not_revoked, check_token_version, get_token_version,
+)
 
 User = get_user_model()
 
@@ -36,6 +47,7 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         validated_data.pop('confirm_password', None) 
         password = validated_data.pop('password')
+        profile_image = validated_data.pop('profile_image', None)
         
         # Default role is set to 'student' in the model, so we don't need to pass it here.
         user = User.objects.create_user(
@@ -44,8 +56,11 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
             **validated_data
         )
 
-        student_group, _ = Group.objects.get_or_create(name='Student')
-        user.groups.add(student_group)
+        add_to_group(user, STUDENT)
+
+        # resized and uploaded in the background
+        if profile_image:
+            run_in_background(process_profile_image, user.pk, read_upload(profile_image))
 
         return user
 
@@ -79,53 +94,202 @@ class AdminRegistrationSerializer(serializers.ModelSerializer):
             **validated_data
         )
 
-        admin_group, _ = Group.objects.get_or_create(name='Admin')
-        user.groups.add(admin_group)
+        add_to_group(user, ADMIN)
 
         return user
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+
+        # claims used by StatelessJWTAuthentication, access tokens copy them from the refresh token
+        token['email'] = user.email
+        token['role'] = get_role(user)
+        token['is_active'] = user.is_active
+        token['is_staff'] = user.is_staff
+        token[TOKEN_VERSION_CLAIM] = user.token_version
+        return token
+
     def validate(self, attrs):
         data = super().validate(attrs)
         
-        # trigger the update_last_login signal
-        update_last_login(None, self.user)
-        
-        role = 'Student' # default fallback
-        # get the first group name to use as the role, handles cases where a user might be in multiple groups or none
-        if self.user.groups.exists():
-            role = self.user.groups.first().name
+        # last_login and the login event are written in bulk by users.auth_events
+        record_login(self.user, self.context.get('request'))
 
         # Add extra data to the response
-        data['user'] = {
-            'id': self.user.id,
-            'email': self.user.email,
-            'first_name': self.user.first_name,
-            'last_name': self.user.last_name,
-            'role': role
+        data['user'] = self.get_user_data(self.user)
+        return data
+
+    @staticmethod
+    def get_user_data(user):
+        return {
+            'id': user.id,
+            'email': user.email,
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+            'role': get_role(user)
         }
+
+class CustomTokenRefreshSerializer(TokenRefreshSerializer):
+    def validate(self, attrs):
+        refresh = RefreshToken(attrs['refresh'])
+
+        # refuse refresh tokens issued before a deactivation or password reset
+        user_id = refresh.payload.get(api_settings.USER_ID_CLAIM)
+        if user_id:
+            current_version = get_token_version(user_id)
+            if current_version is not None:
+                check_token_version(refresh, current_version)
+        check_not_revoked(refresh)
+
+        data = super().validate(attrs)
+        record_event(AuthEvent.REFRESH, user_id, self.context.get('request'))
         return data
 
+class LogoutSerializer(serializers.Serializer):
+    refresh = serializers.CharField()
+
+    def validate_refresh(self, value):
+        try:
+            refresh = RefreshToken(value)
+        except TokenError as e:
+            raise serializers.ValidationError(str(e))
+
+        # users can only log out their own sessions
+        if str(refresh.get(api_settings.USER_ID_CLAIM)) != str(self.context['request'].user.pk):
+            raise serializers.ValidationError('Token does not belong to this user.')
+        return refresh
+
 class UserProfileSerializer(serializers.ModelSerializer):
     role = serializers.SerializerMethodField()
     
     profile_image = serializers.ImageField(read_only=False)
+    profile_image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = User
-        fields = ['id', 'email', 'role', 'first_name', 'last_name', 'phone_number', 'profile_image', 'date_joined', 'last_login']
+        fields = ['id', 'email', 'role', 'first_name', 'last_name', 'phone_number', 'profile_image', 'profile_image_variants', 'date_joined', 'last_login']
         read_only_fields = ['id', 'email', 'role', 'date_joined', 'last_login']
 
     def get_role(self, obj):
-        if obj.groups.exists():
-            return obj.groups.first().name
-        return 'Student'
+        return get_role(obj)
+
+    def get_profile_image_variants(self, obj):
+        if not obj.profile_image:
+            return {}
+        storage = obj.profile_image.storage
+        request = self.context.get('request')
+        urls = {size: storage.url(name) for size, name in obj.profile_image_variants.items()}
+        if request is not None:
+            # absolute like the profile_image url itself
+            urls = {size: request.build_absolute_uri(url) for size, url in urls.items()}
+        return urls
+
+    def update(self, instance, validated_data):
+        # the new image shows up once the background job has resized and stored it
+        profile_image = validated_data.pop('profile_image', None)
+        if profile_image:
+            run_in_background(process_profile_image, instance.pk, read_upload(profile_image))
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        # only the edited columns, a full save would write back a token_version
+        # that was bumped while the request ran
+        instance.save(update_fields=list(validated_data))
+        return instance
+
+
+class UserDirectorySerializer(serializers.ModelSerializer):
+    # read only listing for admins, groups come from the prefetch done by the view
+    role = serializers.SerializerMethodField()
+    groups = serializers.SerializerMethodField()
+
+    class Meta:
+        model = User
+        fields = ['id', 'email', 'first_name', 'last_name', 'phone_number', 'role', 'groups',
+                  'is_active', 'is_staff', 'date_joined', 'last_login']
+        read_only_fields = fields
+
+    def get_role(self, obj):
+        return get_role(obj)
+
+    def get_groups(self, obj):
+        return list(get_user_groups(obj))
+
+
+class PublicProfileSerializer(serializers.ModelSerializer):
+    # what other users get to see, read only, groups come from the prefetch done by the view
+    role = serializers.SerializerMethodField()
+    profile_image = serializers.SerializerMethodField()
+    profile_image_variants = serializers.SerializerMethodField()
+
+    class Meta:
+        model = User
+        fields = ['id', 'first_name', 'last_name', 'role', 'profile_image', 'profile_image_variants']
+        read_only_fields = fields
+
+    def get_role(self, obj):
+        return get_role(obj)
+
+    # storage urls, the view makes them absolute for the requesting host
+    def get_profile_image(self, obj):
+        return obj.profile_image.url if obj.profile_image else None
+
+    def get_profile_image_variants(self, obj):
+        if not obj.profile_image:
+            return {}
+        storage = obj.profile_image.storage
+        return {size: storage.url(name) for size, name in obj.profile_image_variants.items()}
+
+
+class UserBatchSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.UUIDField(), min_length=1, max_length=settings.USER_BATCH_MAX_IDS
+    )
+
+
+class UserFilterSerializer(serializers.Serializer):
+    # the filters of the user directory
+    search = serializers.CharField(required=False, allow_blank=True)
+    group = serializers.CharField(required=False)
+    is_active = serializers.BooleanField(required=False, allow_null=True, default=None)
+
+
+class BulkUserOperationSerializer(serializers.Serializer):
+    action = serializers.ChoiceField(choices=bulk.ACTIONS)
+    group = serializers.SlugRelatedField(slug_field='name', queryset=Group.objects.all(), required=False)
+    ids = serializers.ListField(
+        child=serializers.UUIDField(), required=False, max_length=settings.BULK_USER_MAX_IDS
+    )
+    filter = UserFilterSerializer(required=False)
+
+    def validate_filter(self, value):
+        # an empty filter matches everyone
+        if not (value.get('search', '').strip() or value.get('group') or value['is_active'] is not None):
+            raise serializers.ValidationError("The filter needs at least one of 'search', 'group', 'is_active'.")
+        return value
+
+    def validate(self, attrs):
+        if ('ids' in attrs) == ('filter' in attrs):
+            raise serializers.ValidationError("Pass either 'ids' or 'filter'.")
+        if attrs['action'] in (bulk.ADD_GROUP, bulk.REMOVE_GROUP) and 'group' not in attrs:
+            raise serializers.ValidationError({'group': "This action needs a group."})
+        return attrs
 
 
 class VerifyEmailSerializer(serializers.Serializer):
     email = serializers.EmailField()
     otp = serializers.CharField(max_length=5)
 
+    @staticmethod
+    def check_otp_result(result):
+        if result == OTP_MISSING:
+            raise AuthenticationFailed('Invalid OTP or expired')
+        if result == OTP_EXPIRED:
+            raise AuthenticationFailed('OTP has expired. Please request a new one.')
+        if result == OTP_INVALID:
+            raise AuthenticationFailed('Invalid OTP')
+
     def validate(self, attrs):
         email = attrs.get('email')
         otp = attrs.get('otp')
@@ -135,33 +299,20 @@ class VerifyEmailSerializer(serializers.Serializer):
         except User.DoesNotExist:
             raise AuthenticationFailed('User not found')
         
-        try:
-            user_otp = OneTimePassword.objects.get(user=user)
-        except OneTimePassword.DoesNotExist:
-            raise AuthenticationFailed('Invalid OTP or expired')
-        
-        # check if OTP is expired
-        if user_otp.created_at < timezone.now() - timedelta(minutes=5):
-            user_otp.delete() # auto-remove expired OTP
-            raise AuthenticationFailed('OTP has expired. Please request a new one.')
-
-        if user_otp.otp != otp:
-            raise AuthenticationFailed('Invalid OTP')
+        result = get_otp_backend().verify(user, otp)
+        record_otp_check(user.pk, result, self.context.get('request'))
+        self.check_otp_result(result)
         
+        # the OTP backend has consumed the code at this point
         attrs['user'] = user
-        attrs['otp_obj'] = user_otp
         return attrs
     
     def save(self):
         user = self.validated_data['user']
-        otp_obj = self.validated_data['otp_obj']
 
         if not user.is_active:
             user.is_active = True
-            user.save()
-
-        # delete the otp after successful verification
-        otp_obj.delete()
+            user.save(update_fields=['is_active'])
 
         return user
 
@@ -208,6 +359,13 @@ class SetNewPasswordSerializer(serializers.Serializer):
 
     class Meta:
         fields = ['email', 'otp', 'password', 'confirm_password']
+
+    @staticmethod
+    def check_otp_result(result):
+        if result in (OTP_MISSING, OTP_EXPIRED):
+            raise AuthenticationFailed('Invalid OTP or OTP expired.')
+        if result == OTP_INVALID:
+             raise AuthenticationFailed('Invalid OTP.')
     
     def validate(self, attrs):
         if attrs['password'] != attrs['confirm_password']:
@@ -221,28 +379,22 @@ class SetNewPasswordSerializer(serializers.Serializer):
         except User.DoesNotExist:
             raise AuthenticationFailed('User not found.')
 
-        try:
-            user_otp = OneTimePassword.objects.get(user=user)
-        except OneTimePassword.DoesNotExist:
-            raise AuthenticationFailed('Invalid OTP or OTP expired.')
-
-        if user_otp.otp != otp:
-             raise AuthenticationFailed('Invalid OTP.')
+        result = get_otp_backend().verify(user, otp)
+        record_otp_check(user.pk, result, self.context.get('request'))
+        self.check_otp_result(result)
         
         # Determine validated data for save method
         attrs['user'] = user
-        attrs['otp_obj'] = user_otp 
         return attrs
     
     def save(self, **kwargs):
         user = self.validated_data['user']
-        otp_obj = self.validated_data['otp_obj']
         password = self.validated_data['password']
         
         user.set_password(password)
-        user.save()
-        
-        # Delete OTP after use
-        otp_obj.delete()
+        user.save(update_fields=['password'])
+
+        # log out every session that was using the old password
+        bump_token_version([user.pk])
         
         return user
\ No newline at end of file
@@ -1,6 +1,5 @@
-import requests
-from django.core.files.base import ContentFile
-from django.db.models.signals import post_save
+from django.contrib.auth.signals import user_login_failed
+from django.db.models.signals import m2m_changed, post_save, pre_delete
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
@@ -8,21 +7,84 @@ from django.contrib.auth.models import Group
 # Import the signal from allauth
 from allauth.account.signals import user_signed_up
 
+from .roles import ADMIN, STUDENT, invalidate_user_groups
+from .groups import add_to_group, reset as reset_group_registry
+from .profile_cache import invalidate_profiles
+from .authentication import bump_token_version
+from .auth_events import record_event
+from .avatars import ingest_avatar
+from .models import AuthEvent
+from .tasks import run_in_background
+
 User = get_user_model()
 
 
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_cached_groups(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        # user.groups.add/remove/clear(...)
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            instance._group_names = None
+            invalidate_memberships([instance.pk])
+        return
+
+    # group.user_set.add/remove(...), pk_set holds the user ids
+    if action in ('post_add', 'post_remove'):
+        invalidate_memberships(pk_set)
+    elif action == 'pre_clear':
+        invalidate_memberships(list(instance.user_set.values_list('pk', flat=True)))
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def invalidate_group_members(sender, instance, created=False, **kwargs):
+    reset_group_registry()
+    # a renamed or deleted group changes the role of all of its members
+    if not created:
+        invalidate_memberships(list(instance.user_set.values_list('pk', flat=True)))
+
+
+def invalidate_memberships(user_ids):
+    # the role is part of the cached profile
+    invalidate_user_groups(user_ids)
+    invalidate_profiles(user_ids)
+
+
+@receiver(post_save, sender=User)
+def invalidate_cached_profile(sender, instance, **kwargs):
+    # covers profile updates, image processing and update_last_login()
+    invalidate_profiles([instance.pk])
+
+
 @receiver(post_save, sender=User)
 def assign_group_to_superuser(sender, instance, created, **kwargs):
     if created and instance.is_superuser:
-        admin_group, _ = Group.objects.get_or_create(name='Admin')
-        instance.groups.add(admin_group)
+        add_to_group(instance, ADMIN)
+
+
+@receiver(post_save, sender=User)
+def revoke_tokens_on_deactivation(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and 'is_active' not in update_fields:
+        return
+    was_active = instance._loaded_is_active
+    instance._loaded_is_active = instance.is_active
+    # only an actual deactivation revokes, not every save of an inactive user
+    if created or instance.is_active or was_active is False:
+        return
+    bump_token_version([instance.pk])
+    instance.refresh_from_db(fields=['token_version'])
+
+
+@receiver(user_login_failed)
+def record_failed_login(sender, credentials, request=None, **kwargs):
+    # the password in credentials is already masked by Django
+    record_event(AuthEvent.LOGIN_FAILED, request=request, email=credentials.get('email'))
 
 
 @receiver(user_signed_up)
 def populate_profile(request, user, **kwargs):
     # Assign Role (Group)
-    student_group, _ = Group.objects.get_or_create(name='Student')
-    user.groups.add(student_group)
+    add_to_group(user, STUDENT)
 
     # Extract Name from Google
     # The signal passes a 'sociallogin' object in kwargs
@@ -41,23 +103,12 @@ def populate_profile(request, user, **kwargs):
         # get profile image
         picture_url = data.get('picture')
 
-        # only download if the user doesn't already have an image and a URL exists
+        # only download if the user doesn't already have an image and a URL exists,
+        # the download and upload run in the background so sign-up doesn't wait on the CDN
         if picture_url and not user.profile_image:
-            try:
-                response = requests.get(picture_url)
-                if response.status_code == 200:
-                    file_name = f"profile_{user.id}.jpg"
-
-                    # save the image to the field (uploads to cloudinary automatically)
-                    user.profile_image.save(
-                        file_name,
-                        ContentFile(response.content),
-                        save=False # save explicitly at the end
-                    )
-            except Exception as e:
-                print(f"Failed to download google profile image: {e}")
-
-        user.save()
+            run_in_background(ingest_avatar, user.pk, picture_url)
+
+        user.save(update_fields=['first_name', 'last_name'])
         
         # If 'name' is missing, try combining given_name + family_name
         # if not google_name:
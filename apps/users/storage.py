@@ -0,0 +1,55 @@
+import hashlib
+import os
+import posixpath
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Media on local disk (MEDIA_ROOT) named after the SHA-256 of the content,
+    e.g. 'profile_images/3f/3fa9...e1.jpg'. The same content is stored once
+    however often it is uploaded, and url() is string formatting, no I/O.
+
+    The upload is streamed to a temporary file in chunks while it is hashed,
+    then renamed into place, so a file is never seen half written. Files are
+    shared between everything that stored the same content, don't delete
+    them through one of the references.
+    """
+    chunk_size = 64 * 1024
+
+    def get_available_name(self, name, max_length=None):
+        # the name is decided by the content in _save(), an existing file with it holds the same bytes
+        return name
+
+    def _save(self, name, content):
+        directory = posixpath.dirname(name)
+        extension = posixpath.splitext(name)[1].lower()
+        full_directory = self.path(directory)
+        os.makedirs(full_directory, exist_ok=True)
+
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=full_directory, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks(self.chunk_size):
+                    digest.update(chunk)
+                    f.write(chunk)
+
+            hexdigest = digest.hexdigest()
+            name = posixpath.join(directory, hexdigest[:2], hexdigest + extension)
+            path = self.path(name)
+            if os.path.exists(path):
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(temp_path, self.file_permissions_mode)
+                # atomic, a concurrent upload of the same content writes the same bytes
+                os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return name
@@ -0,0 +1,46 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from . import routers
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.BACKGROUND_TASK_WORKERS,
+            thread_name_prefix='users-task',
+        )
+    return _executor
+
+
+def _run(fn, args, kwargs):
+    # the job reads its own writes, the next job on this thread starts unpinned
+    tokens = routers.start_request(False)
+    try:
+        fn(*args, **kwargs)
+    except Exception:
+        logger.exception("Background task %s failed", fn.__name__)
+    finally:
+        routers.end_request(tokens)
+        # DB connections are per thread, don't leave this worker's connection open
+        connections.close_all()
+
+
+def submit(fn, *args, **kwargs):
+    return get_executor().submit(_run, fn, args, kwargs)
+
+
+def run_in_background(fn, *args, **kwargs):
+    """
+    Runs fn off the request thread once the current transaction commits,
+    so the job always sees the rows the request created.
+    """
+    transaction.on_commit(lambda: submit(fn, *args, **kwargs))
@@ -1,3 +1,1468 @@
-from django.test import TestCase
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import re
+import statistics
+import tempfile
+import threading
+import time
+import types
+import uuid
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, reverse
+from django.utils import timezone
+from django.utils.http import urlencode
+from PIL import Image
+from asgiref.sync import async_to_sync
+from rest_framework.test import APITestCase
+from rest_framework.views import APIView
+
+from users import auth_events, caching, groups, hashing, images, outbox, revocation, routers, tasks, timing, warmup
+from users.authentication import ClaimsUser, StatelessJWTAuthentication, bump_token_version
+from users.avatars import AvatarTooLarge, ingest_avatar
+from users.groups import get_group_id
+from users.management.commands import profile_startup
+from users.middleware import ReplicaPinMiddleware, ServerTimingMiddleware
+from users.models import AuthEvent, EmailOutbox, OneTimePassword, RevokedToken, User
+from users.otp import OTP_INVALID, OTP_MISSING, OTP_VALID, CacheOTPBackend, get_otp_backend
+from users.roles import ADMIN, STUDENT, get_user_groups
+from users.routers import PrimaryReplicaRouter, primary
+from users.storage import ContentAddressedStorage
+from users.throttling import IPRateThrottle
+from users.views import metrics_view
+from users.serializers import CustomTokenObtainPairSerializer, UserProfileSerializer
+
+# AUTH_BENCH_USERS=100000 AUTH_BENCH_ITERATIONS=500 AUTH_BENCH_REPORT=1 python manage.py test users
+SEED_USERS = int(os.environ.get('AUTH_BENCH_USERS', 500))
+ITERATIONS = int(os.environ.get('AUTH_BENCH_ITERATIONS', 20))
+REPORT = bool(os.environ.get('AUTH_BENCH_REPORT'))
+
+PASSWORD = 'bench-password-123'
+
+# throttling is covered by its own test, the benchmark must not trip it
+UNTHROTTLED = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}}
+
+
+def image_bytes(size=(8, 8), format='PNG', mode='RGB'):
+    buffer = io.BytesIO()
+    Image.new(mode, size).save(buffer, format)
+    return buffer.getvalue()
+
+
+class TemporaryMediaMixin:
+    # media is written to a temporary directory instead of MEDIA_STORAGE
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        storages = {
+            **settings.STORAGES,
+            'default': {
+                'BACKEND': 'django.core.files.storage.FileSystemStorage',
+                'OPTIONS': {'location': directory.name, 'base_url': '/media/'},
+            },
+        }
+        override = override_settings(STORAGES=storages)
+        override.enable()
+        self.addCleanup(override.disable)
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+# PBKDF2 cost is measured by `manage.py bench_password_hashing`, here it would only hide the
+# queries. The auth event buffer is only written when a test flushes it.
+@override_settings(
+    PASSWORD_HASH_ITERATIONS=1000,
+    REST_FRAMEWORK=UNTHROTTLED,
+    AUTH_EVENT_FLUSH_INTERVAL=3600,
+    AUTH_EVENT_BUFFER_SIZE=10 ** 6,
+    REVOCATION_SYNC_INTERVAL=3600,
+)
+class AuthAPITestCase(APITestCase):
+    """
+    Seeds `seed_users` students, bench<i>@example.com with PASSWORD, and
+    signs the client in as one of them.
+    """
+    seed_users = 200
+
+    @classmethod
+    def setUpTestData(cls):
+        encoded = make_password(PASSWORD)
+
+        users = [
+            User(email=f'bench{i}@example.com', password=encoded, first_name='Bench', last_name=str(i))
+            for i in range(cls.seed_users)
+        ]
+        User.objects.bulk_create(users, batch_size=1000)
+        User.groups.through.objects.bulk_create(
+            [User.groups.through(user_id=user.pk, group_id=get_group_id(STUDENT)) for user in users],
+            batch_size=1000,
+        )
+        cls.users = users
+
+    def setUp(self):
+        cache.clear()
+        # whatever a test buffers is discarded with its data
+        self.addCleanup(auth_events.take)
+        # revocation filter syncs are not part of any request's budget
+        revocation.sync(rebuild=True)
+
+    def user(self, i):
+        return self.users[i % len(self.users)]
+
+    def authenticate(self, user):
+        token = CustomTokenObtainPairSerializer.get_token(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def authenticate_admin(self):
+        admin = self.user(0)
+        admin.groups.add(Group.objects.get(name=ADMIN))
+        self.authenticate(admin)
+
+    def login(self, user):
+        response = self.client.post(reverse('login'), {'email': user.email, 'password': PASSWORD})
+        data = response.json()
+        return data['access'], data['refresh']
+
+    def issue_otp(self, i):
+        return get_otp_backend().issue(self.user(i))
+
+    def batch(self, ids):
+        return self.client.get(reverse('user-batch'), {'ids': ','.join(str(user_id) for user_id in ids)})
+
+
+class AuthEndpointBenchmarkTests(AuthAPITestCase):
+    """
+    Drives every /auth/ endpoint in-process, asserts a query budget per request
+    and reports p50/p99 latency and queries per request.
+    """
+    seed_users = SEED_USERS
+    results = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        if REPORT:
+            print(f"\n{'endpoint':<26}{'p50 ms':>10}{'p99 ms':>10}{'queries':>10}{'max':>6}{'budget':>8}")
+            for name, (timings, queries, budget) in sorted(cls.results.items()):
+                print(
+                    f"{name:<26}{percentile(timings, 50) * 1000:>10.2f}{percentile(timings, 99) * 1000:>10.2f}"
+                    f"{statistics.mean(queries):>10.1f}{max(queries):>6}{budget:>8}"
+                )
+
+    def measure(self, name, budget, request, expected_status, prepare=None):
+        """
+        Runs request(i) ITERATIONS times, failing as soon as one of them needs
+        more than `budget` queries. prepare(i) runs outside of the measurement
+        and its result is passed on to request().
+        """
+        timings, queries = [], []
+        for i in range(ITERATIONS):
+            args = (prepare(i),) if prepare else ()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = request(i, *args)
+                timings.append(time.perf_counter() - started)
+
+            self.assertEqual(response.status_code, expected_status, response.content)
+            queries.append(len(captured))
+            self.assertLessEqual(
+                len(captured), budget,
+                f"{name} ran {len(captured)} queries (budget {budget}):\n"
+                + '\n'.join(query['sql'] for query in captured.captured_queries)
+            )
+
+        self.results[name] = (timings, queries, budget)
+
+    def test_register(self):
+        def request(i):
+            return self.client.post(reverse('register'), {
+                'email': f'new-{uuid.uuid4().hex}@example.com',
+                'password': PASSWORD,
+                'confirm_password': PASSWORD,
+                'first_name': 'New',
+                'last_name': 'User',
+            })
+
+        self.measure('register', 10, request, 201)
+
+    def test_login(self):
+        def request(i):
+            return self.client.post(reverse('login'), {'email': self.user(i).email, 'password': PASSWORD})
+
+        self.measure('login', 2, request, 200)
+
+    def test_refresh(self):
+        def prepare(i):
+            return str(CustomTokenObtainPairSerializer.get_token(self.user(i)))
+
+        def request(i, refresh):
+            return self.client.post(reverse('token_refresh'), {'refresh': refresh})
+
+        self.measure('token_refresh', 2, request, 200, prepare=prepare)
+
+    def test_profile_get(self):
+        self.authenticate(self.user(0))
+
+        self.measure('profile GET', 1, lambda i: self.client.get(reverse('profile')), 200)
+
+    def test_profile_not_modified(self):
+        self.authenticate(self.user(0))
+        etag = self.client.get(reverse('profile'))['ETag']
+
+        def request(i):
+            return self.client.get(reverse('profile'), HTTP_IF_NONE_MATCH=etag)
+
+        self.measure('profile GET 304', 1, request, 304)
+
+    def test_profile_patch(self):
+        self.authenticate(self.user(0))
+
+        def request(i):
+            return self.client.patch(reverse('profile'), {'first_name': f'Name{i}'})
+
+        self.measure('profile PATCH', 2, request, 200)
+
+    def test_verify_email(self):
+        def request(i, otp):
+            return self.client.post(reverse('verify-email'), {'email': self.user(i).email, 'otp': otp})
+
+        self.measure('verify-email', 3, request, 200, prepare=self.issue_otp)
+
+    def test_password_reset_request(self):
+        def request(i):
+            return self.client.post(reverse('password-reset-request'), {'email': self.user(i).email})
+
+        self.measure('password-reset-request', 9, request, 200)
+
+    def test_password_reset_confirm(self):
+        def request(i, otp):
+            return self.client.patch(reverse('password-reset-confirm'), {
+                'email': self.user(i).email, 'otp': otp, 'password': PASSWORD, 'confirm_password': PASSWORD,
+            })
+
+        self.measure('password-reset-confirm', 5, request, 200, prepare=self.issue_otp)
+
+    def test_unrevoked_token_check_runs_no_queries(self):
+        revocation.revoke_tokens([CustomTokenObtainPairSerializer.get_token(self.user(1))])
+
+        with self.assertNumQueries(0):
+            self.assertFalse(revocation.is_revoked(uuid.uuid4().hex))
+
+    def test_user_directory_page(self):
+        self.authenticate_admin()
+
+        def request(i):
+            return self.client.get(reverse('user-directory'), {'page_size': 100})
+
+        # user, admin check, page and groups prefetch, whatever the page size
+        self.measure('user directory', 4, request, 200)
+
+    def test_user_batch(self):
+        self.authenticate(self.user(0))
+        ids = [self.users[i].pk for i in range(1, 101)]
+
+        def cold(i):
+            cache.clear()
+            return self.batch(ids)
+
+        # user, then one query for the 100 profiles and one for their groups
+        self.measure('user batch (cold)', 3, cold, 200)
+        # served from the per-user cache
+        self.measure('user batch (cached)', 1, lambda i: self.batch(ids), 200)
+
+    @override_settings(REST_FRAMEWORK=settings.REST_FRAMEWORK)
+    def test_throttled_request_runs_no_queries(self):
+        email = self.user(0).email
+        self.client.post(reverse('resend-activation-code'), {'email': email})
+
+        with self.assertNumQueries(0):
+            response = self.client.post(reverse('resend-activation-code'), {'email': email})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+
+class StatelessAuthMixin:
+    """
+    Runs a test case with JWT_STATELESS_AUTH=True. The views read their
+    authentication classes at import, so the setting itself can't be overridden.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        patcher = mock.patch.object(APIView, 'authentication_classes', [StatelessJWTAuthentication])
+        patcher.start()
+        cls.addClassCleanup(patcher.stop)
+        super().setUpClass()
+
+
+def async_urlconf():
+    # /auth/ as config/asgi.py serves it, users.urls picks the views at import
+    spec = importlib.util.find_spec('users.urls')
+    auth_urls = importlib.util.module_from_spec(spec)
+    with override_settings(ASYNC_AUTH_VIEWS=True):
+        spec.loader.exec_module(auth_urls)
+
+    urlconf = types.ModuleType('async_urlconf')
+    urlconf.urlpatterns = [path('auth/', include(auth_urls)), path('metrics', metrics_view, name='metrics')]
+    return urlconf
+
+
+class AsyncViewsMixin:
+    """
+    Runs a test case against the views in users.async_views (ASYNC_AUTH_VIEWS=True).
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.enterClassContext(override_settings(ROOT_URLCONF=async_urlconf()))
+        super().setUpClass()
+
+
+class AsyncAuthEndpointBenchmarkTests(AsyncViewsMixin, AuthEndpointBenchmarkTests):
+    results = {}
+
+
+class StatelessAuthEndpointBenchmarkTests(StatelessAuthMixin, AuthEndpointBenchmarkTests):
+    results = {}
+
+    def test_cached_profile_runs_no_queries(self):
+        self.authenticate(self.user(0))
+        self.client.get(reverse('profile'))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('profile'))
+        self.assertEqual(response.status_code, 200)
+
+
+class ClaimsUserTests(AuthAPITestCase):
+    seed_users = 1
+
+    def test_claims_user_private_attributes(self):
+        token = CustomTokenObtainPairSerializer.get_token(self.user(0)).access_token
+        user = ClaimsUser(token)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(getattr(user, '_prefetched_objects_cache', {}), {})
+            with self.assertRaises(AttributeError):
+                user._state
+        self.assertEqual(user.first_name, 'Bench')
+
+
+class AsyncAuthViewTests(AsyncViewsMixin, AuthAPITestCase):
+    def test_profile_patch_uploads_the_image(self):
+        user = self.user(0)
+        self.authenticate(user)
+        upload = SimpleUploadedFile('avatar.png', image_bytes(), content_type='image/png')
+
+        with mock.patch('users.async_views.submit') as submit:
+            response = self.client.patch(reverse('profile'), {'first_name': 'Changed', 'profile_image': upload})
+
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(User.objects.get(pk=user.pk).first_name, 'Changed')
+        self.assertEqual(submit.call_args.args[1], user.pk)
+
+    def test_form_encoded_patch(self):
+        otp = self.issue_otp(1)
+        body = urlencode({
+            'email': self.user(1).email,
+            'otp': otp,
+            'password': 'new-password-123',
+            'confirm_password': 'new-password-123',
+        })
+        response = self.client.patch(
+            reverse('password-reset-confirm'), body, content_type='application/x-www-form-urlencoded'
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(User.objects.get(pk=self.user(1).pk).check_password('new-password-123'))
+
+    def test_login_goes_through_the_backends(self):
+        user = self.user(1)
+        User.objects.filter(pk=user.pk).update(is_active=False)
+
+        with mock.patch('users.backends.ExecutorModelBackend.aauthenticate', return_value=None) as backend:
+            response = self.client.post(reverse('login'), {'email': self.user(2).email, 'password': PASSWORD})
+        self.assertEqual(response.status_code, 401)
+        backend.assert_called_once()
+
+        # inactive users are turned away by the backend, the failures are recorded by the signal receiver
+        response = self.client.post(reverse('login'), {'email': user.email, 'password': PASSWORD})
+        self.assertEqual(response.status_code, 401)
+        _, events = auth_events.take()
+        self.assertEqual([event[0] for event in events], [AuthEvent.LOGIN_FAILED] * 2)
+
+
+class ProfileETagTests(AuthAPITestCase):
+    def test_profile_etag_changes_with_profile(self):
+        user = self.user(0)
+        self.authenticate(user)
+        etag = self.client.get(reverse('profile'))['ETag']
+
+        self.client.patch(reverse('profile'), {'first_name': 'Changed'})
+        response = self.client.get(reverse('profile'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['first_name'], 'Changed')
+        self.assertNotEqual(response['ETag'], etag)
+
+        # a group change alters the role
+        etag = response['ETag']
+        user.groups.set([Group.objects.get(name=ADMIN)])
+        response = self.client.get(reverse('profile'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['role'], ADMIN)
+
+
+class AsyncProfileETagTests(AsyncViewsMixin, ProfileETagTests):
+    pass
+
+
+class StatelessProfileETagTests(StatelessAuthMixin, ProfileETagTests):
+    pass
+
+
+class LoginSideEffectsTests(AuthAPITestCase):
+    def test_login_side_effects_are_written_in_bulk(self):
+        logins = 10
+        for i in range(logins):
+            self.client.post(reverse('login'), {'email': self.user(i).email, 'password': PASSWORD})
+        self.client.post(reverse('login'), {'email': self.user(0).email, 'password': 'wrong-password'})
+
+        with CaptureQueriesContext(connection) as captured:
+            written = auth_events.flush()
+
+        self.assertEqual(written, (logins, logins + 1))
+        # bulk UPDATE and INSERT (with their savepoints) plus the user lookup, independent of the batch size
+        self.assertLessEqual(len(captured), 7)
+        self.assertEqual(User.objects.filter(last_login__isnull=False).count(), logins)
+        self.assertTrue(
+            AuthEvent.objects.filter(event=AuthEvent.LOGIN_FAILED, user=self.user(0)).exists()
+        )
+
+
+class AsyncLoginSideEffectsTests(AsyncViewsMixin, LoginSideEffectsTests):
+    pass
+
+
+class LogoutTests(AuthAPITestCase):
+    def test_logout_revokes_both_tokens(self):
+        access, refresh = self.login(self.user(0))
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+
+        response = self.client.post(reverse('logout'), {'refresh': refresh})
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 401)
+        self.client.credentials()
+        self.assertEqual(self.client.post(reverse('token_refresh'), {'refresh': refresh}).status_code, 401)
+
+    def test_logout_all_revokes_every_session(self):
+        user = self.user(0)
+        other_access, other_refresh = self.login(user)
+        access, _ = self.login(user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+
+        self.assertEqual(self.client.post(reverse('logout-all')).status_code, 200)
+
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 401)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {other_access}')
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 401)
+        self.client.credentials()
+        self.assertEqual(self.client.post(reverse('token_refresh'), {'refresh': other_refresh}).status_code, 401)
+
+
+class AsyncLogoutTests(AsyncViewsMixin, LogoutTests):
+    pass
+
+
+class StatelessLogoutTests(StatelessAuthMixin, LogoutTests):
+    pass
+
+
+class UserDirectoryTests(AuthAPITestCase):
+    def test_user_directory_walks_every_user_once(self):
+        self.authenticate_admin()
+        # ties on date_joined are broken by id
+        tied = [user.pk for user in self.users[:10]]
+        User.objects.filter(pk__in=tied).update(date_joined=self.users[0].date_joined)
+
+        seen = []
+        url = reverse('user-directory') + '?page_size=7'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(len(seen), User.objects.count())
+
+    def test_user_directory_filters(self):
+        self.authenticate_admin()
+        url = reverse('user-directory')
+
+        response = self.client.get(url, {'search': 'bench1', 'page_size': 200})
+        self.assertTrue(response.data['results'])
+        self.assertTrue(all(row['email'].startswith('bench1') for row in response.data['results']))
+
+        response = self.client.get(url, {'group': ADMIN})
+        self.assertEqual([row['email'] for row in response.data['results']], [self.user(0).email])
+
+        response = self.client.get(url, {'is_active': 'false'})
+        self.assertEqual(response.data['results'], [])
+
+        self.assertEqual(self.client.get(url, {'is_active': 'foo'}).status_code, 400)
+
+    def test_user_directory_is_admin_only(self):
+        self.authenticate(self.user(1))
+        self.assertEqual(self.client.get(reverse('user-directory')).status_code, 403)
+
+
+class StatelessUserDirectoryTests(StatelessAuthMixin, UserDirectoryTests):
+    pass
+
+
+class BulkUserOperationTests(AuthAPITestCase):
+    def bulk(self, **data):
+        return self.client.post(reverse('user-bulk'), data, format='json')
+
+    def test_bulk_deactivate_and_activate(self):
+        target = self.user(5)
+        access, _ = self.login(target)
+        self.authenticate_admin()
+        ids = [str(user.pk) for user in self.users[:50]]
+
+        with CaptureQueriesContext(connection) as captured:
+            response = self.bulk(action='deactivate', ids=ids)
+        # the requesting admin is left alone
+        self.assertEqual(response.data, {'action': 'deactivate', 'matched': 49, 'changed': 49})
+        # chunked set based queries, not one per user
+        self.assertLess(len(captured), 15)
+
+        # deactivation revoked the existing tokens
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 401)
+
+        self.authenticate_admin()
+        response = self.bulk(action='activate', ids=ids)
+        self.assertEqual(response.data['changed'], 49)
+        self.assertEqual(User.objects.filter(is_active=False).count(), 0)
+
+    def test_bulk_group_changes_by_filter(self):
+        self.authenticate_admin()
+        matching = User.objects.filter(email__startswith='bench1').exclude(pk=self.user(0).pk)
+        member = matching.first()
+        self.assertEqual(get_user_groups(User.objects.get(pk=member.pk)), (STUDENT,))
+
+        response = self.bulk(action='add_group', group=ADMIN, filter={'search': 'bench1'})
+        self.assertEqual(response.data['changed'], matching.count())
+        # memberships that already exist are not counted again
+        self.assertEqual(self.bulk(action='add_group', group=ADMIN, filter={'search': 'bench1'}).data['changed'], 0)
+
+        # the cached groups were invalidated for the whole batch
+        self.assertEqual(get_user_groups(User.objects.get(pk=member.pk)), (ADMIN, STUDENT))
+
+        response = self.bulk(action='remove_group', group=ADMIN, filter={'search': 'bench1'})
+        self.assertEqual(response.data['changed'], matching.count())
+        self.assertEqual(get_user_groups(User.objects.get(pk=member.pk)), (STUDENT,))
+
+    def test_bulk_validation(self):
+        self.authenticate_admin()
+        self.assertEqual(self.bulk(action='add_group', ids=[str(self.user(1).pk)]).status_code, 400)
+        self.assertEqual(self.bulk(action='activate').status_code, 400)
+        self.assertEqual(self.bulk(action='add_group', group='Nope', ids=[str(self.user(1).pk)]).status_code, 400)
+        # a filter has to narrow the users down
+        self.assertEqual(self.bulk(action='deactivate', filter={}).status_code, 400)
+        self.assertEqual(self.bulk(action='deactivate', filter={'search': ' ', 'is_active': None}).status_code, 400)
+        self.assertFalse(User.objects.filter(is_active=False).exists())
+
+    @override_settings(BULK_USER_MAX_IDS=11)
+    def test_bulk_filter_is_capped(self):
+        self.authenticate_admin()
+        response = self.bulk(action='deactivate', filter={'is_active': True})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(User.objects.filter(is_active=False).exists())
+
+        self.assertEqual(self.bulk(action='deactivate', filter={'search': 'bench10'}).data['changed'], 11)
+
+
+class StatelessBulkUserOperationTests(StatelessAuthMixin, BulkUserOperationTests):
+    pass
+
+
+class MetricsTests(AuthAPITestCase):
+    seed_users = 3
+
+    def metric(self, sample):
+        with override_settings(METRICS_TOKEN='secret'):
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        for line in response.content.decode().splitlines():
+            if line.startswith(sample + ' '):
+                return float(line.rsplit(' ', 1)[1])
+        return 0.0
+
+    def test_metrics(self):
+        samples = [
+            'users_logins_total{result="success"}',
+            'users_logins_total{result="failure"}',
+            'users_otp_checks_total{result="invalid"}',
+            'users_http_request_duration_seconds_count{url_name="login"}',
+        ]
+        before = [self.metric(sample) for sample in samples]
+
+        self.login(self.user(1))
+        self.client.post(reverse('login'), {'email': self.user(1).email, 'password': 'wrong-password'})
+        self.issue_otp(2)
+        self.client.post(reverse('verify-email'), {'email': self.user(2).email, 'otp': '00000'})
+
+        after = [self.metric(sample) for sample in samples]
+        self.assertEqual([b - a for a, b in zip(before, after)], [1, 1, 1, 2])
+
+    def test_metrics_add_up_all_processes(self):
+        sample = 'users_logins_total{result="success"}'
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            before = self.metric(sample)
+            # what another worker wrote
+            with open(os.path.join(directory, '1.json'), 'w') as f:
+                json.dump({'users_logins_total': [[['success'], 5]]}, f)
+            self.assertEqual(self.metric(sample), before + 5)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_metrics_need_a_token_unless_debugging(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        with override_settings(DEBUG=True):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+
+class AsyncMetricsTests(AsyncViewsMixin, MetricsTests):
+    pass
+
+
+class UserBatchTests(AuthAPITestCase):
+    def test_user_batch_contents(self):
+        self.authenticate(self.user(0))
+        first, second, inactive = self.user(1), self.user(2), self.user(3)
+        User.objects.filter(pk=inactive.pk).update(is_active=False)
+
+        response = self.batch([second.pk, uuid.uuid4(), inactive.pk, first.pk, second.pk])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['id'] for row in response.data['results']], [str(second.pk), str(first.pk)])
+        self.assertEqual(response.data['results'][0]['role'], STUDENT)
+        self.assertNotIn('email', response.data['results'][0])
+
+        # cached entries are dropped when the user changes
+        first.first_name = 'Renamed'
+        first.save()
+        self.assertEqual(self.batch([first.pk]).data['results'][0]['first_name'], 'Renamed')
+
+    def test_user_batch_validation(self):
+        self.authenticate(self.user(0))
+        self.assertEqual(self.client.get(reverse('user-batch')).status_code, 400)
+        self.assertEqual(self.client.get(reverse('user-batch'), {'ids': 'nope'}).status_code, 400)
+        too_many = [uuid.uuid4() for _ in range(settings.USER_BATCH_MAX_IDS + 1)]
+        self.assertEqual(self.batch(too_many).status_code, 400)
+
+
+class StatelessUserBatchTests(StatelessAuthMixin, UserBatchTests):
+    pass
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000, REST_FRAMEWORK=UNTHROTTLED)
+class TokenRevocationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='revoke@example.com', password=PASSWORD)
+
+    def token_version(self):
+        return User.objects.values_list('token_version', flat=True).get(pk=self.user.pk)
+
+    def test_deactivation_revokes_once(self):
+        user = User.objects.get(pk=self.user.pk)
+        user.is_active = False
+        user.save()
+        self.assertEqual(self.token_version(), 1)
+
+        # saving an inactive user again is not another deactivation
+        user.first_name = 'Changed'
+        user.save()
+        User.objects.get(pk=self.user.pk).save()
+        self.assertEqual(self.token_version(), 1)
+
+    def test_profile_patch_keeps_a_concurrent_revocation(self):
+        token = CustomTokenObtainPairSerializer.get_token(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+        # the tokens are revoked after the view has loaded the user
+        def validate(attrs):
+            bump_token_version([self.user.pk])
+            return attrs
+
+        with mock.patch.object(UserProfileSerializer, 'validate', side_effect=validate):
+            response = self.client.patch(reverse('profile'), {'first_name': 'Changed'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.token_version(), 1)
+        self.assertEqual(User.objects.get(pk=self.user.pk).first_name, 'Changed')
+
+
+@override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {'test_ip': '4/m'}})
+class TokenBucketThrottleTests(SimpleTestCase):
+    view = types.SimpleNamespace(throttle_scope='test')
+
+    def setUp(self):
+        cache.clear()
+        self.request = RequestFactory().post('/', REMOTE_ADDR='10.0.0.1')
+        self.now = 1000.0
+        patcher = mock.patch('time.time', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def allowed(self, count):
+        return [IPRateThrottle().allow_request(self.request, self.view) for _ in range(count)]
+
+    def test_burst_then_continuous_refill(self):
+        self.assertEqual(self.allowed(5), [True] * 4 + [False])
+        throttle = IPRateThrottle()
+        self.assertFalse(throttle.allow_request(self.request, self.view))
+        self.assertEqual(throttle.wait(), 15)
+
+        # a token every 15 seconds, not all of them at the end of a window
+        self.now += 15
+        self.assertEqual(self.allowed(2), [True, False])
+        self.now += 30
+        self.assertEqual(self.allowed(3), [True, True, False])
+
+    def test_no_double_burst_across_periods(self):
+        self.now += 59
+        self.assertEqual(self.allowed(4), [True] * 4)
+        self.now += 2
+        self.assertEqual(self.allowed(2), [False, False])
+
+    def test_full_again_after_a_period(self):
+        self.assertEqual(self.allowed(5), [True] * 4 + [False])
+        self.now += 60
+        self.assertEqual(self.allowed(5), [True] * 4 + [False])
+
+    def test_concurrent_requests_share_the_bucket(self):
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(self.allowed(1)[0])) for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(results), [False] * 4 + [True] * 4)
+
+    def test_async(self):
+        allow = async_to_sync(IPRateThrottle().aallow_request)
+        self.assertEqual([allow(self.request, self.view) for _ in range(5)], [True] * 4 + [False])
+        # shares the bucket with the sync path
+        self.now += 15
+        self.assertEqual(self.allowed(2), [True, False])
+
+
+class ServerTimingTests(TestCase):
+    def get_response(self, request):
+        User.objects.count()
+        with timing.timed('hash'):
+            pass
+        return HttpResponse()
+
+    def call(self):
+        return ServerTimingMiddleware(self.get_response)(RequestFactory().get('/'))
+
+    @override_settings(SERVER_TIMING_HEADER=True)
+    def test_header(self):
+        self.assertRegex(
+            self.call()['Server-Timing'],
+            r'^db;dur=[\d.]+;desc="1 query", hash;dur=[\d.]+;desc="1 call", total;dur=[\d.]+$',
+        )
+
+    @override_settings(SERVER_TIMING_HEADER=False)
+    def test_header_switched_off(self):
+        self.assertNotIn('Server-Timing', self.call())
+
+    @override_settings(SLOW_REQUEST_THRESHOLD_MS=0, SLOW_REQUEST_SAMPLE_RATE=1)
+    def test_slow_request_log(self):
+        with self.assertLogs('users.middleware', 'WARNING') as logs:
+            self.call()
+        self.assertIn('Slow request GET / -> 200', logs.output[0])
+        # with the slowest queries
+        self.assertIn('FROM "users_user"', logs.output[0])
+
+    @override_settings(SLOW_REQUEST_THRESHOLD_MS=0, SLOW_REQUEST_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_logged(self):
+        with self.assertNoLogs('users.middleware', 'WARNING'):
+            self.call()
+
+    def test_queries_are_only_recorded_during_a_request(self):
+        timings, token = timing.start(keep_queries=True)
+        User.objects.count()
+        timing.stop(token)
+        User.objects.count()
+
+        self.assertEqual(timings.spans['db'][1], 1)
+        self.assertEqual(len(timings.queries), 1)
+        self.assertIsNone(timing.current())
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'], REPLICA_STICKY_SECONDS=5)
+class ReplicaRoutingTests(SimpleTestCase):
+    """
+    Routing decisions only, no replica database is needed.
+    """
+    router = PrimaryReplicaRouter()
+
+    def setUp(self):
+        # every test runs as a request of its own
+        self.addCleanup(routers.end_request, routers.start_request(False))
+
+    def request(self, method='get', cookie=None, write=False):
+        # runs a request through ReplicaPinMiddleware, returns (database read from, response)
+        routed = []
+
+        def view(request):
+            if write:
+                self.router.db_for_write(User)
+            routed.append(self.router.db_for_read(User))
+            return HttpResponse()
+
+        request = getattr(RequestFactory(), method)('/auth/profile/')
+        if cookie is not None:
+            request.COOKIES[settings.REPLICA_PIN_COOKIE] = cookie
+        response = ReplicaPinMiddleware(view)(request)
+        return routed[0], response
+
+    def test_reads_go_to_a_replica(self):
+        database, response = self.request()
+        self.assertEqual(database, 'replica1')
+        self.assertNotIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+
+    def test_unsafe_requests_use_the_primary(self):
+        self.assertEqual(self.request('post')[0], 'default')
+
+    def test_reads_after_a_write_stick_to_the_primary(self):
+        database, response = self.request(write=True)
+        self.assertEqual(database, 'default')
+        pin = response.cookies[settings.REPLICA_PIN_COOKIE]
+
+        self.assertEqual(self.request(cookie=pin.value)[0], 'default')
+        self.assertEqual(self.request(cookie=str(int(time.time()) - 1))[0], 'replica1')
+        self.assertEqual(self.request(cookie='garbage')[0], 'replica1')
+        # the pin doesn't leak out of the request
+        self.assertEqual(self.router.db_for_read(User), 'replica1')
+
+    def test_background_jobs_are_pinned_one_at_a_time(self):
+        routed = []
+
+        def job(write):
+            if write:
+                self.router.db_for_write(User)
+            routed.append(self.router.db_for_read(User))
+
+        def worker():
+            tasks._run(job, (True,), {})
+            tasks._run(job, (False,), {})
+            # a thread outside of any job or request isn't pinned by its writes
+            self.router.db_for_write(User)
+            routed.append(self.router.db_for_read(User))
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        self.assertEqual(routed, ['default', 'replica1', 'replica1'])
+
+    def test_cache_fills_read_from_the_primary(self):
+        with primary():
+            self.assertEqual(self.router.db_for_read(User), 'default')
+        self.assertEqual(self.router.db_for_read(User), 'replica1')
+
+
+class ContentAddressedStorageTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = ContentAddressedStorage(location=directory.name, base_url='/media/')
+
+    def test_same_content_is_stored_once(self):
+        content = b'x' * (ContentAddressedStorage.chunk_size * 3 + 1)
+        digest = hashlib.sha256(content).hexdigest()
+
+        first = self.storage.save('profile_images/upload.JPG', ContentFile(content))
+        second = self.storage.save('profile_images/other.jpg', ContentFile(content))
+
+        self.assertEqual(first, f'profile_images/{digest[:2]}/{digest}.jpg')
+        self.assertEqual(second, first)
+        self.assertEqual(self.storage.listdir(f'profile_images/{digest[:2]}'), ([], [f'{digest}.jpg']))
+        with self.storage.open(first) as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(self.storage.url(first), f'/media/{first}')
+
+    def test_different_content_gets_different_names(self):
+        first = self.storage.save('profile_images/a.jpg', ContentFile(b'a'))
+        second = self.storage.save('profile_images/a.jpg', ContentFile(b'b'))
+        self.assertNotEqual(first, second)
+
+
+class DeleteOnCommitTests(TestCase):
+    def test_deleted_again_after_the_commit(self):
+        cache.set('key', 1)
+        with mock.patch.object(cache, 'delete_many', wraps=cache.delete_many) as delete_many:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                caching.delete_on_commit(['key'])
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(delete_many.call_count, 2)
+        self.assertIsNone(cache.get('key'))
+
+    def test_deleted_once_in_autocommit(self):
+        # as outside of the test's transaction
+        with mock.patch.object(transaction.get_connection(), 'in_atomic_block', False):
+            with mock.patch.object(cache, 'delete_many') as delete_many, self.captureOnCommitCallbacks() as callbacks:
+                caching.delete_on_commit(['key'])
+        self.assertEqual(callbacks, [])
+        delete_many.assert_called_once_with(['key'])
+
+
+class FailingConnection:
+    # an SMTP connection that refuses every message
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def send_messages(self, messages):
+        raise OSError('Connection refused')
+
+
+class UnreachableConnection(FailingConnection):
+    # refuses the message, then can't reconnect
+    def open(self):
+        raise OSError('Network is unreachable')
+
+
+class EmailOutboxTests(TestCase):
+    def queue(self, count):
+        return [outbox.queue_email(f'Subject {i}', 'Body', [f'to{i}@example.com']) for i in range(count)]
+
+    def test_drain_sends_every_due_message(self):
+        self.queue(3)
+
+        self.assertEqual(outbox.drain(batch_size=2), (3, 0))
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(
+            set(EmailOutbox.objects.values_list('status', 'attempts', 'body')), {(EmailOutbox.STATUS_SENT, 1, '')}
+        )
+        self.assertEqual(outbox.queue_depth(), 0)
+
+    def test_claimed_messages_are_not_claimed_again(self):
+        first, second = self.queue(2)
+
+        self.assertEqual(outbox.claim_batch(1), [first])
+        # the claimed row is out of the due window until EMAIL_OUTBOX_CLAIM_TIMEOUT
+        self.assertEqual(outbox.claim_batch(10), [second])
+        self.assertEqual(outbox.claim_batch(10), [])
+
+    def test_failed_messages_are_retried_with_backoff(self):
+        row, = self.queue(1)
+
+        self.assertEqual(outbox.deliver_batch(FailingConnection(), 10), (0, 1))
+        row.refresh_from_db()
+        self.assertEqual(
+            (row.status, row.attempts, row.last_error), (EmailOutbox.STATUS_PENDING, 1, 'Connection refused')
+        )
+        delay = row.next_attempt_at - timezone.now()
+        self.assertTrue(timedelta(seconds=25) < delay <= timedelta(seconds=30))
+        # not due yet
+        self.assertEqual(outbox.deliver_batch(FailingConnection(), 10), (0, 0))
+
+    def test_rest_of_the_batch_is_released_when_reconnecting_fails(self):
+        first, *rest = self.queue(3)
+
+        with self.assertRaises(OSError):
+            outbox.deliver_batch(UnreachableConnection(), 10)
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.attempts), (EmailOutbox.STATUS_PENDING, 1))
+        # due again without waiting out EMAIL_OUTBOX_CLAIM_TIMEOUT
+        self.assertEqual(outbox.claim_batch(10), rest)
+        self.assertEqual([row.attempts for row in rest], [0, 0])
+
+    def test_retry_delay_doubles_up_to_the_cap(self):
+        self.assertEqual(
+            [outbox.retry_delay(attempts).total_seconds() for attempts in (1, 2, 3, 8, 20)],
+            [30, 60, 120, 3600, 3600],
+        )
+
+    @override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+    def test_gives_up_after_the_last_attempt(self):
+        row, = self.queue(1)
+        EmailOutbox.objects.filter(pk=row.pk).update(attempts=1)
+
+        self.assertEqual(outbox.deliver_batch(FailingConnection(), 10), (0, 1))
+        row.refresh_from_db()
+        self.assertEqual((row.status, row.attempts, row.body), (EmailOutbox.STATUS_FAILED, 2, ''))
+        self.assertEqual(outbox.queue_depth(), 0)
+
+
+class FakeAvatarResponse:
+    def __init__(self, content, content_length=True):
+        self.content = content
+        self.headers = {'Content-Length': str(len(content))} if content_length else {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+
+class AvatarIngestionTests(TemporaryMediaMixin, TestCase):
+    url = 'https://lh3.googleusercontent.com/a/picture'
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email='social@example.com')
+        patcher = mock.patch('users.avatars.get_session')
+        self.session = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.session.get.return_value = FakeAvatarResponse(image_bytes((400, 300), 'JPEG'))
+
+    def test_picture_is_attached_with_its_variants(self):
+        ingest_avatar(self.user.pk, self.url)
+
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.profile_image.name.endswith('.jpg'))
+        self.assertEqual(set(self.user.profile_image_variants), {'64', '128', '256'})
+        self.assertTrue(self.user.profile_image.storage.exists(self.user.profile_image.name))
+
+    def test_a_picture_url_is_downloaded_once(self):
+        other = User.objects.create_user(email='social2@example.com')
+        ingest_avatar(self.user.pk, self.url)
+        ingest_avatar(other.pk, self.url)
+
+        self.session.get.assert_called_once()
+        other.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual(other.profile_image.name, self.user.profile_image.name)
+
+    def test_an_uploaded_image_is_kept(self):
+        User.objects.filter(pk=self.user.pk).update(profile_image='profile_images/own.jpg')
+        ingest_avatar(self.user.pk, self.url)
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.profile_image.name, 'profile_images/own.jpg')
+
+    @override_settings(AVATAR_MAX_BYTES=100)
+    def test_oversized_pictures_are_refused(self):
+        # by the announced length, and while streaming when there is none
+        for content_length in (True, False):
+            self.session.get.return_value = FakeAvatarResponse(b'x' * 101, content_length)
+            with self.assertRaises(AvatarTooLarge):
+                ingest_avatar(self.user.pk, f'{self.url}?{content_length}')
+
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.profile_image)
+
+
+class ProfileImageTests(TemporaryMediaMixin, TestCase):
+    def open(self, name):
+        storage = User._meta.get_field('profile_image').storage
+        with storage.open(name) as f:
+            return Image.open(io.BytesIO(f.read()))
+
+    @override_settings(PROFILE_IMAGE_MAX_SIZE=200)
+    def test_images_are_normalized_with_thumbnails(self):
+        # a transparent PNG, larger than PROFILE_IMAGE_MAX_SIZE
+        stored = images.store_profile_image(image_bytes((800, 400), 'PNG', 'RGBA'))
+
+        image = self.open(stored['name'])
+        self.assertEqual((image.format, image.mode, image.size), ('JPEG', 'RGB', (200, 100)))
+        # the transparent pixels were flattened onto white
+        self.assertEqual(image.getpixel((100, 50)), (255, 255, 255))
+
+        self.assertEqual(list(stored['variants']), ['64', '128', '256'])
+        self.assertEqual(self.open(stored['variants']['64']).size, (64, 32))
+        # never scaled up
+        self.assertEqual(self.open(stored['variants']['256']).size, (200, 100))
+
+    def test_metadata_is_stripped(self):
+        buffer = io.BytesIO()
+        exif = Image.Exif()
+        exif[0x010F] = 'Camera maker'
+        Image.new('RGB', (50, 50)).save(buffer, 'JPEG', exif=exif)
+
+        image = self.open(images.store_profile_image(buffer.getvalue())['name'])
+        self.assertFalse(image.getexif())
+
+    def test_identical_uploads_are_processed_once(self):
+        data = image_bytes((100, 100))
+        with mock.patch('users.images.save_file', wraps=images.save_file) as save_file:
+            first = images.store_profile_image(data)
+            second = images.store_profile_image(data)
+
+        self.assertEqual(first, second)
+        # the image and its three thumbnails
+        self.assertEqual(save_file.call_count, 4)
+
+    def test_profile_shows_the_thumbnails(self):
+        user = User.objects.create_user(email='images@example.com')
+        images.process_profile_image(user.pk, image_bytes((300, 300)))
+        user.refresh_from_db()
+
+        data = UserProfileSerializer(user, context={'request': RequestFactory().get('/')}).data
+        self.assertEqual(set(data['profile_image_variants']), {'64', '128', '256'})
+        self.assertTrue(data['profile_image_variants']['64'].startswith('http://testserver/media/profile_images/'))
+
+
+class CacheOTPBackendTests(SimpleTestCase):
+    backend = CacheOTPBackend()
+    user = types.SimpleNamespace(pk=uuid.uuid4())
+
+    def setUp(self):
+        cache.clear()
+
+    # never issued, codes are 10000-99999
+    wrong = '00000'
+
+    def test_a_code_is_used_once(self):
+        otp = self.backend.issue(self.user)
+        self.assertRegex(otp, r'^\d{5}$')
+        self.assertEqual(self.backend.verify(self.user, otp), OTP_VALID)
+        self.assertEqual(self.backend.verify(self.user, otp), OTP_MISSING)
+
+    def test_a_new_code_replaces_the_previous_one(self):
+        first = self.backend.issue(self.user)
+        second = self.backend.issue(self.user)
+        if first != second:
+            self.assertEqual(self.backend.verify(self.user, first), OTP_INVALID)
+        self.assertEqual(self.backend.verify(self.user, second), OTP_VALID)
+
+    @override_settings(OTP_MAX_ATTEMPTS=3)
+    def test_code_is_discarded_after_too_many_attempts(self):
+        otp = self.backend.issue(self.user)
+        self.assertEqual([self.backend.verify(self.user, self.wrong) for _ in range(3)], [OTP_INVALID] * 3)
+        self.assertEqual(self.backend.verify(self.user, otp), OTP_MISSING)
+
+        # a new code starts counting again
+        otp = self.backend.issue(self.user)
+        self.assertEqual(self.backend.verify(self.user, self.wrong), OTP_INVALID)
+        self.assertEqual(self.backend.verify(self.user, otp), OTP_VALID)
+
+    def test_codes_expire(self):
+        now = time.time()
+        with mock.patch('time.time', return_value=now):
+            otp = self.backend.issue(self.user)
+        with mock.patch('time.time', return_value=now + settings.OTP_TTL + 1):
+            self.assertEqual(self.backend.verify(self.user, otp), OTP_MISSING)
+
+    def test_async(self):
+        otp = async_to_sync(self.backend.aissue)(self.user)
+        self.assertEqual(async_to_sync(self.backend.averify)(self.user, self.wrong), OTP_INVALID)
+        self.assertEqual(async_to_sync(self.backend.averify)(self.user, otp), OTP_VALID)
+        # consumed for the sync path as well
+        self.assertEqual(self.backend.verify(self.user, otp), OTP_MISSING)
+
+
+class SweepStaleDataTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        old = now - timedelta(days=settings.UNVERIFIED_ACCOUNT_TTL_DAYS + 1)
+
+        def user(email, **fields):
+            return User.objects.create(**{'email': email, 'is_active': False, 'date_joined': old, **fields})
+
+        # swept: never verified and older than UNVERIFIED_ACCOUNT_TTL_DAYS
+        cls.stale = [user(f'stale{i}@example.com') for i in range(5)]
+        # kept: recent, once used, staff
+        cls.kept = [
+            user('recent@example.com', date_joined=now),
+            user('used@example.com', last_login=old),
+            user('staff@example.com', is_staff=True),
+        ]
+
+        for kept in cls.kept:
+            OneTimePassword.objects.create(user=kept, otp='12345')
+        OneTimePassword.objects.filter(user__in=cls.kept[:2]).update(created_at=old)
+
+        RevokedToken.objects.bulk_create([
+            RevokedToken(jti=f'expired{i}', expires_at=now - timedelta(minutes=1)) for i in range(3)
+        ] + [RevokedToken(jti='valid', expires_at=now + timedelta(minutes=1))])
+
+        messages = EmailOutbox.objects.bulk_create([
+            EmailOutbox(subject=status, body='', status=status)
+            for status in (EmailOutbox.STATUS_SENT, EmailOutbox.STATUS_FAILED, EmailOutbox.STATUS_PENDING)
+        ] + [EmailOutbox(subject='recent', body='', status=EmailOutbox.STATUS_SENT)])
+        # created_at is set on insert
+        EmailOutbox.objects.filter(pk__in=[message.pk for message in messages[:3]]).update(created_at=old)
+
+    def sweep(self, **options):
+        stdout = io.StringIO()
+        with mock.patch('users.management.commands.sweep_stale_data.time.sleep') as sleep:
+            call_command('sweep_stale_data', chunk_size=2, stdout=stdout, **options)
+        return stdout.getvalue(), sleep.call_count
+
+    def test_sweep_in_chunks(self):
+        output, chunks = self.sweep()
+
+        self.assertIn('Deleted 2 expired OTP(s).', output)
+        self.assertIn('Deleted 5 unverified account(s).', output)
+        self.assertIn('Deleted 3 expired revoked token(s).', output)
+        self.assertIn('Deleted 2 outbox message(s).', output)
+        # 1 + 3 + 2 + 1 chunks of at most 2 rows, each followed by a pause
+        self.assertEqual(chunks, 7)
+
+        self.assertEqual(set(User.objects.all()), set(self.kept))
+        self.assertEqual(list(OneTimePassword.objects.values_list('user', flat=True)), [self.kept[2].pk])
+        self.assertEqual(list(RevokedToken.objects.values_list('jti', flat=True)), ['valid'])
+        self.assertEqual(set(EmailOutbox.objects.values_list('subject', flat=True)), {'pending', 'recent'})
+
+    def test_dry_run_deletes_nothing(self):
+        output, chunks = self.sweep(dry_run=True)
+
+        self.assertIn('Would delete 2 expired OTP(s).', output)
+        self.assertIn('Would delete 5 unverified account(s).', output)
+        self.assertIn('Would delete 3 expired revoked token(s).', output)
+        self.assertIn('Would delete 2 outbox message(s).', output)
+        self.assertEqual(chunks, 0)
+        self.assertEqual(User.objects.count(), 8)
+        self.assertEqual(OneTimePassword.objects.count(), 3)
+        self.assertEqual(RevokedToken.objects.count(), 4)
+        self.assertEqual(EmailOutbox.objects.count(), 4)
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000)
+class ImportUsersTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'users.csv')
+
+    def write(self, *rows):
+        with open(self.path, 'w') as f:
+            f.write('email,first_name,last_name,phone_number,password,role\n')
+            f.writelines(f'{row}\n' for row in rows)
+
+    def run_import(self, **options):
+        call_command('import_users', self.path, workers=1, batch_size=2, stdout=io.StringIO(), **options)
+
+    def test_import(self):
+        self.write(
+            'Ada@Example.com,Ada,Lovelace,,secret-password,',
+            'grace@example.com,Grace,Hopper,555,,admin',
+            # the same address again
+            'Ada@example.com,Someone,Else,,,',
+        )
+        self.run_import()
+
+        ada = User.objects.get(email='Ada@example.com')
+        self.assertEqual((ada.first_name, ada.phone_number, ada.is_staff), ('Ada', None, False))
+        self.assertTrue(ada.check_password('secret-password'))
+        self.assertEqual(get_user_groups(ada), (STUDENT,))
+
+        grace = User.objects.get(email='grace@example.com')
+        self.assertFalse(grace.has_usable_password())
+        self.assertTrue(grace.is_staff)
+        self.assertEqual(get_user_groups(grace), (ADMIN,))
+
+        self.assertEqual(User.objects.count(), 2)
+        with open(f'{self.path}.checkpoint') as f:
+            self.assertEqual(json.load(f), {'rows': 3})
+
+    def test_existing_users_are_skipped(self):
+        self.write('ada@example.com,Ada,,,,', 'grace@example.com,Grace,,,,')
+        User.objects.create_user(email='ada@example.com', first_name='Existing')
+
+        self.run_import()
+        self.assertEqual(User.objects.get(email='ada@example.com').first_name, 'Existing')
+        self.assertTrue(User.objects.filter(email='grace@example.com').exists())
+
+    def test_resume_after_the_checkpoint(self):
+        self.write('ada@example.com,Ada,,,,', 'grace@example.com,Grace,,,,')
+        with open(f'{self.path}.checkpoint', 'w') as f:
+            json.dump({'rows': 1}, f)
+
+        self.run_import(resume=True)
+        self.assertEqual(list(User.objects.values_list('email', flat=True)), ['grace@example.com'])
+
+    def test_unknown_role_imports_nothing(self):
+        # the bad row is in the second batch
+        self.write('a@example.com,,,,,', 'b@example.com,,,,,', 'c@example.com,,,,,teacher')
+
+        with self.assertRaisesMessage(CommandError, "Unknown role 'Teacher' in row 3"):
+            self.run_import()
+        self.assertFalse(User.objects.exists())
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000, PASSWORD_HASHING_WORKERS=2)
+class PasswordHashingTests(TestCase):
+    def setUp(self):
+        # a fresh executor with PASSWORD_HASHING_WORKERS threads
+        previous, hashing._executor = hashing._executor, None
+        self.addCleanup(setattr, hashing, '_executor', previous)
+        self.addCleanup(lambda: hashing._executor and hashing._executor.shutdown())
+
+    def test_hashes_run_on_the_executor(self):
+        with mock.patch('users.hashing.make_password', side_effect=lambda raw: threading.current_thread().name):
+            self.assertTrue(hashing.hash_password('secret').startswith('password-hash'))
+            self.assertTrue(async_to_sync(hashing.ahash_password)('secret').startswith('password-hash'))
+
+    def test_concurrent_hashes_are_capped(self):
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def make_password(raw):
+            with lock:
+                running.append(raw)
+                peak.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.remove(raw)
+            return raw
+
+        with mock.patch('users.hashing.make_password', side_effect=make_password):
+            threads = [threading.Thread(target=hashing.hash_password, args=(str(i),)) for i in range(6)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(peak), 6)
+        self.assertEqual(max(peak), 2)
+
+    def test_work_factor_comes_from_the_settings(self):
+        encoded = hashing.hash_password('secret')
+        self.assertEqual(encoded.split('$')[:2], ['pbkdf2_sha256', '1000'])
+        self.assertEqual(hashing.verify_password('secret', encoded), (True, False))
+        self.assertEqual(async_to_sync(hashing.averify_password)('wrong', encoded), (False, False))
+
+        # a changed work factor asks for an upgrade
+        with override_settings(PASSWORD_HASH_ITERATIONS=2000):
+            self.assertEqual(hashing.verify_password('secret', encoded), (True, True))
+
+    def test_upgrade_skips_a_changed_password(self):
+        user = User.objects.create_user(email='hash@example.com', password='secret')
+        old = user.password
+
+        with override_settings(PASSWORD_HASH_ITERATIONS=2000):
+            hashing.upgrade_password_hash(user.pk, old, 'secret')
+        user.refresh_from_db()
+        self.assertEqual(user.password.split('$')[1], '2000')
+        self.assertTrue(user.check_password('secret'))
+
+        # the password was changed since the login that asked for the upgrade
+        hashing.upgrade_password_hash(user.pk, old, 'secret')
+        self.assertEqual(User.objects.get(pk=user.pk).password, user.password)
+
+
+class GroupRegistryTests(TestCase):
+    def test_async_lookup_survives_a_reset(self):
+        groups.reset()
+        get_group_ids = groups.get_group_ids
+
+        def load_then_reset():
+            # a Group signal in another thread, right after the load
+            group_ids = get_group_ids()
+            groups.reset()
+            return group_ids
+
+        with mock.patch('users.groups.get_group_ids', load_then_reset):
+            group_id = async_to_sync(groups.aget_group_id)(STUDENT)
+        self.assertEqual(group_id, Group.objects.get(name=STUDENT).pk)
+
+
+class WarmupTests(TestCase):
+    def test_warm_runs_every_step(self):
+        groups.reset()
+        with mock.patch('users.warmup.connections.close_all') as close_all:
+            timings = warmup.warm()
+
+        self.assertEqual(list(timings), [name for name, _ in warmup.STEPS])
+        # the group registry is loaded, the first request needs no query for it
+        with self.assertNumQueries(0):
+            groups.get_group_id(STUDENT)
+        # nothing is inherited by the forked workers
+        close_all.assert_called_once()
+
+    def test_a_step_without_database_is_skipped(self):
+        steps = [('broken', mock.Mock(side_effect=DatabaseError('unreachable'))), ('next', mock.Mock())]
+        with (
+            mock.patch.object(warmup, 'STEPS', steps),
+            mock.patch('users.warmup.connections.close_all'),
+            self.assertLogs('users.warmup', 'WARNING'),
+        ):
+            timings = warmup.warm()
+
+        self.assertEqual(list(timings), ['broken', 'next'])
+        steps[1][1].assert_called_once()
+
+
+class ProfileStartupTests(SimpleTestCase):
+    def profile(self, **options):
+        stdout = io.StringIO()
+        call_command('profile_startup', top=3, stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def test_report(self):
+        # without the warmup, it would run against the configured database, not the test one
+        output = self.profile(no_warmup=True)
+
+        self.assertRegex(output, r'django.setup\(\): \d+ ms, \d+ modules imported')
+        # --top packages
+        packages = output.split('\n\n')[0]
+        self.assertEqual(len(re.findall(r'^\S+ +[\d.]+ +\d+$', packages, re.MULTILINE)), 3)
+        self.assertRegex(output, r'\nusers +[\d.]+\n')
+        self.assertNotIn('warmup step', output)
+
+    def test_warmup_steps_are_reported(self):
+        report = {'setup': 0.5, 'ready': [['users', 0.01]], 'warmup': {'groups': 0.002, 'jwt': 0.001}}
+        result = mock.Mock(returncode=0, stdout=json.dumps(report), stderr='')
+        with mock.patch('subprocess.run', return_value=result) as run:
+            output = self.profile()
+
+        self.assertIn('if True:', run.call_args.args[0][-1])
+        self.assertRegex(output, r'\ngroups +2.0\njwt +1.0\n')
+
+    def test_parse_importtime(self):
+        output = (
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       120 |        120 |   _io\n'
+            'import time:      2500 |       4000 | django.db\n'
+            'something else\n'
+        )
+        command = profile_startup.Command()
+        self.assertEqual(command.parse_importtime(output), [('_io', 120, 120), ('django.db', 2500, 4000)])
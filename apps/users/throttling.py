@@ -0,0 +1,166 @@
+import math
+import re
+import time
+
+from django.core.cache import cache
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """
+    '5/hour' -> (5, 3600), '3/15m' -> (3, 900), '1/90s' -> (1, 90)
+    """
+    num, period = rate.split('/')
+    multiplier, unit = re.fullmatch(r'(\d*)([a-z]+)', period).groups()
+    return int(num), int(multiplier or 1) * PERIODS[unit[0]]
+
+
+def timeout(milliseconds):
+    # cache timeouts are whole seconds on some backends, a bucket may outlive being full by < 1s
+    return math.ceil(milliseconds / 1000)
+
+
+def get_request_email(request):
+    email = request.data.get('email') if hasattr(request.data, 'get') else None
+    if not isinstance(email, str) or not email.strip():
+        return None
+    return email.strip().lower()
+
+
+class ScopedTokenBucketThrottle(BaseThrottle):
+    """
+    Token bucket kept in the shared cache. Every key holds up to `capacity`
+    tokens and gets them back continuously, capacity per period, so a client
+    can burst `capacity` requests once and then only as fast as the refill,
+    there is no window edge to burst across.
+
+    The bucket is stored the GCRA way, as the time (ms) at which it is full
+    again. A request moves that time one token interval ahead with an atomic
+    incr() and is refused if it ends up more than a period ahead of now. The
+    key expires when the bucket is full, an empty key is created with add(),
+    so the limit holds across all app nodes without a lock.
+
+    The policy is looked up as '<view.throttle_scope>_<suffix>' in
+    DEFAULT_THROTTLE_RATES, views without a matching rate are not throttled.
+    """
+    suffix = None
+
+    def get_ident_key(self, request):
+        raise NotImplementedError
+
+    def get_policy(self, request, view):
+        scope = f"{getattr(view, 'throttle_scope', None)}_{self.suffix}"
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+        ident = self.get_ident_key(request)
+        if rate is None or ident is None:
+            return None
+        capacity, period = parse_rate(rate)
+        return f'throttle:{scope}:{ident}', capacity, period
+
+    def allow_request(self, request, view):
+        policy = self.get_policy(request, view)
+        if policy is None:
+            return True
+        key, capacity, period = policy
+
+        now = int(time.time() * 1000)
+        interval = math.ceil(period * 1000 / capacity)
+        if cache.add(key, now + interval, timeout(interval)):
+            return True
+        try:
+            full_at = cache.incr(key, interval)
+        except ValueError:
+            # expired since add(), the bucket is full
+            cache.add(key, now + interval, timeout(interval))
+            return True
+        if full_at - now > period * 1000:
+            self.wait_seconds = (full_at - now - period * 1000) / 1000
+            # a refused request doesn't use a token
+            try:
+                cache.decr(key, interval)
+            except ValueError:
+                pass
+            return False
+        cache.touch(key, timeout(full_at - now))
+        return True
+
+    async def aallow_request(self, request, view):
+        policy = self.get_policy(request, view)
+        if policy is None:
+            return True
+        key, capacity, period = policy
+
+        now = int(time.time() * 1000)
+        interval = math.ceil(period * 1000 / capacity)
+        if await cache.aadd(key, now + interval, timeout(interval)):
+            return True
+        try:
+            full_at = await cache.aincr(key, interval)
+        except ValueError:
+            await cache.aadd(key, now + interval, timeout(interval))
+            return True
+        if full_at - now > period * 1000:
+            self.wait_seconds = (full_at - now - period * 1000) / 1000
+            try:
+                await cache.adecr(key, interval)
+            except ValueError:
+                pass
+            return False
+        await cache.atouch(key, timeout(full_at - now))
+        return True
+
+    def wait(self):
+        return math.ceil(self.wait_seconds)
+
+
+class IPRateThrottle(ScopedTokenBucketThrottle):
+    suffix = 'ip'
+
+    def get_ident_key(self, request):
+        return self.get_ident(request)
+
+
+class EmailRateThrottle(ScopedTokenBucketThrottle):
+    suffix = 'email'
+
+    def get_ident_key(self, request):
+        return get_request_email(request)
+
+
+class EmailCooldownThrottle(EmailRateThrottle):
+    """
+    Allows one request per email and period, counted from that request
+    (e.g. '1/60s' for resending a code at most once a minute).
+    """
+    suffix = 'cooldown'
+
+    def allow_request(self, request, view):
+        policy = self.get_policy(request, view)
+        if policy is None:
+            return True
+        key, _, period = policy
+
+        now = time.time()
+        if cache.add(key, now + period, period):
+            return True
+        self.wait_seconds = max((cache.get(key) or now) - now, 1)
+        return False
+
+    async def aallow_request(self, request, view):
+        policy = self.get_policy(request, view)
+        if policy is None:
+            return True
+        key, _, period = policy
+
+        now = time.time()
+        if await cache.aadd(key, now + period, period):
+            return True
+        self.wait_seconds = max((await cache.aget(key) or now) - now, 1)
+        return False
+
+
+# per IP and per email limits, plus the cooldown where a policy defines one
+OTP_THROTTLE_CLASSES = [IPRateThrottle, EmailRateThrottle, EmailCooldownThrottle]
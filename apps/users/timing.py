@@ -0,0 +1,90 @@
+"""
+Per-request timing. ServerTimingMiddleware starts a RequestTimings collector for
+every request; database queries are recorded through a connection execute
+wrapper and the hot paths (password hashing, storage uploads, outbound HTTP,
+SMTP) report their time with timed(). Outside of a request both are no-ops.
+"""
+import contextvars
+import heapq
+import time
+from contextlib import contextmanager
+
+_current = contextvars.ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    def __init__(self, keep_queries=False):
+        self.started = time.perf_counter()
+        self.spans = {}  # name -> [seconds, count]
+        # the SQL is only kept for requests sampled for the slow request log
+        self.queries = [] if keep_queries else None
+
+    def add(self, name, seconds):
+        span = self.spans.setdefault(name, [0.0, 0])
+        span[0] += seconds
+        span[1] += 1
+
+    def add_query(self, sql, seconds):
+        self.add('db', seconds)
+        if self.queries is not None:
+            self.queries.append((seconds, sql))
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def top_queries(self, count):
+        return heapq.nlargest(count, self.queries or [], key=lambda query: query[0])
+
+    def header(self):
+        """
+        'db;dur=12.1;desc="4 queries", hash;dur=80.3;desc="1 call", total;dur=95.0'
+        """
+        entries = []
+        for name, (seconds, count) in self.spans.items():
+            unit = ('query' if count == 1 else 'queries') if name == 'db' else ('call' if count == 1 else 'calls')
+            entries.append(f'{name};dur={seconds * 1000:.1f};desc="{count} {unit}"')
+        entries.append(f'total;dur={self.elapsed() * 1000:.1f}')
+        return ', '.join(entries)
+
+
+def start(keep_queries=False):
+    timings = RequestTimings(keep_queries)
+    return timings, _current.set(timings)
+
+
+def stop(token):
+    _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def timed(name):
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started)
+
+
+def record_query(execute, sql, params, many, context):
+    # contextvars follow the request into sync_to_async threads, so the async views are covered too
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add_query(sql, time.perf_counter() - started)
+
+
+def install_query_timer(sender=None, connection=None, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
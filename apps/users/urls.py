@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 from .views import (
     RegistrationView,
@@ -5,13 +6,30 @@ from .views import (
     LoginView,
     GoogleLoginView,
     CustomTokenRefreshView,
+    LogoutView,
+    LogoutAllView,
     UserProfileView,
+    UserDirectoryView,
+    BulkUserOperationView,
+    UserBatchView,
     VerifyEmailView,
     ResendActivationEmailView,
     PasswordResetRequestView,
     PasswordResetConfirmView,
 )
 
+if settings.ASYNC_AUTH_VIEWS:
+    # native async views, see config/asgi.py
+    from .async_views import (
+        AsyncRegistrationView as RegistrationView,
+        AsyncLoginView as LoginView,
+        AsyncUserProfileView as UserProfileView,
+        AsyncVerifyEmailView as VerifyEmailView,
+        AsyncResendActivationEmailView as ResendActivationEmailView,
+        AsyncPasswordResetRequestView as PasswordResetRequestView,
+        AsyncPasswordResetConfirmView as PasswordResetConfirmView,
+    )
+
 urlpatterns = [
     # Auth & Registration
     path('register/', RegistrationView.as_view(), name='register'),
@@ -19,9 +37,18 @@ urlpatterns = [
     path('login/', LoginView.as_view(), name='login'),
     path('google/', GoogleLoginView.as_view(), name='google-login'),
     path('token/refresh/', CustomTokenRefreshView.as_view(), name='token_refresh'),
+    path('logout/', LogoutView.as_view(), name='logout'),
+    path('logout/all/', LogoutAllView.as_view(), name='logout-all'),
     
     # Profile
     path('profile/', UserProfileView.as_view(), name='profile'),
+
+    # Admin
+    path('users/', UserDirectoryView.as_view(), name='user-directory'),
+    path('users/bulk/', BulkUserOperationView.as_view(), name='user-bulk'),
+
+    # Public profiles
+    path('users/batch/', UserBatchView.as_view(), name='user-batch'),
     
     # Email Verification
     path('verify-email/', VerifyEmailView.as_view(), name='verify-email'),
@@ -1,8 +1,13 @@
 import jwt
 from rest_framework import generics, permissions, status
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db.models import Prefetch
 from rest_framework.request import Request
 from django.conf import settings
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_GET
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
@@ -11,13 +16,28 @@ from allauth.socialaccount.providers.oauth2.client import OAuth2Client
 from dj_rest_auth.registration.views import SocialLoginView
 
 from .utils import send_otp_via_email, send_verification_email
+from .authentication import bump_token_version, get_user_instance
+from .revocation import revoke_tokens
+from .profile_cache import cache_headers, get_profile_representation, get_public_profiles, is_not_modified
+from . import bulk, metrics
+from .pagination import KeysetPagination
+from .routers import from_primary
+from .permissions import IsAdminGroup
+from .throttling import OTP_THROTTLE_CLASSES
 from .serializers import (
     SetNewPasswordSerializer, 
     UserRegistrationSerializer,
     AdminRegistrationSerializer, 
     CustomTokenObtainPairSerializer, 
+    CustomTokenRefreshSerializer,
     UserProfileSerializer, 
     PasswordResetRequestSerializer,
+    LogoutSerializer,
+    BulkUserOperationSerializer,
+    UserDirectorySerializer,
+    UserFilterSerializer,
+    PublicProfileSerializer,
+    UserBatchSerializer,
     VerifyEmailSerializer,
     ResendActivationEmailSerializer,
 )
@@ -29,6 +49,8 @@ class RegistrationView(generics.CreateAPIView):
     queryset = User.objects.all()
     serializer_class = UserRegistrationSerializer
     permission_classes = [permissions.AllowAny]
+    throttle_classes = OTP_THROTTLE_CLASSES
+    throttle_scope = 'register'
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -62,6 +84,8 @@ class AdminRegistrationView(generics.CreateAPIView):
 class VerifyEmailView(generics.GenericAPIView):
     serializer_class = VerifyEmailSerializer
     permission_classes = [permissions.AllowAny]
+    throttle_classes = OTP_THROTTLE_CLASSES
+    throttle_scope = 'verify_email'
 
     def post(self, request):
         serializer = self.get_serializer(data=request.data)
@@ -76,6 +100,8 @@ class VerifyEmailView(generics.GenericAPIView):
 class ResendActivationEmailView(generics.GenericAPIView):
     serializer_class = ResendActivationEmailSerializer
     permission_classes = [permissions.AllowAny]
+    throttle_classes = OTP_THROTTLE_CLASSES
+    throttle_scope = 'resend_activation'
 
     def post(self, request):
         serializer = self.get_serializer(data=request.data)
@@ -93,7 +119,30 @@ class LoginView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
 
 class CustomTokenRefreshView(TokenRefreshView):
-    pass
+    serializer_class = CustomTokenRefreshSerializer
+
+class LogoutView(generics.GenericAPIView):
+    serializer_class = LogoutSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        # the refresh token and the access token used for this request
+        revoke_tokens([serializer.validated_data['refresh'], request.auth])
+
+        return Response({'message': 'Logged out successfully.'}, status=status.HTTP_200_OK)
+
+class LogoutAllView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        # every token issued so far carries the old version and is refused from now on
+        bump_token_version([request.user.pk])
+        revoke_tokens([request.auth])
+
+        return Response({'message': 'Logged out of all sessions.'}, status=status.HTTP_200_OK)
 
 class GoogleAuthClient(OAuth2Client):
     def __init__(self, request, consumer_key, consumer_secret, access_token_method, access_token_url, callback_url, scope, scope_delimiter, headers, basic_auth):
@@ -121,11 +170,130 @@ class UserProfileView(generics.RetrieveUpdateAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_object(self):
-        return self.request.user
+        return get_user_instance(self.request.user)
+
+    def retrieve(self, request, *args, **kwargs):
+        entry = get_profile_representation(
+            request, request.user.pk, lambda: self.get_serializer(from_primary(self.get_object())).data
+        )
+        # an unchanged profile is answered without loading or serializing anything
+        if is_not_modified(request, entry):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(entry['data'])
+        for header, value in cache_headers(entry).items():
+            response[header] = value
+        return response
+
+class UserDirectoryView(generics.ListAPIView):
+    """
+    Admin listing of all users, newest first.
+    ?search=<email prefix, case-sensitive>, ?group=<name>, ?is_active=true|false, ?page_size=, ?cursor=
+    """
+    serializer_class = UserDirectorySerializer
+    permission_classes = [permissions.IsAuthenticated, IsAdminGroup]
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        # the same filters as BulkUserOperationView, a plain dict so that a missing
+        # is_active stays None (BooleanField reads it as False from a QueryDict)
+        serializer = UserFilterSerializer(data=self.request.query_params.dict())
+        serializer.is_valid(raise_exception=True)
+
+        # groups are prefetched for the whole page, users.roles reads them from there
+        return filter_users(User.objects.prefetch_related('groups'), **serializer.validated_data)
+
+def filter_users(queryset, search=None, group=None, is_active=None):
+    search = (search or '').strip()
+    if search:
+        # case-sensitive LIKE 'prefix%', on Postgres served by the varchar_pattern_ops
+        # index Django creates next to the unique constraint on email
+        queryset = queryset.filter(email__startswith=search)
+    if group:
+        queryset = queryset.filter(groups__name=group)
+    if is_active is not None:
+        queryset = queryset.filter(is_active=is_active)
+    return queryset
+
+class BulkUserOperationView(generics.GenericAPIView):
+    """
+    Applies activate / deactivate / add_group / remove_group to a list of
+    user ids or to every user matching a directory filter, both limited to
+    BULK_USER_MAX_IDS users.
+    """
+    serializer_class = BulkUserOperationSerializer
+    permission_classes = [permissions.IsAuthenticated, IsAdminGroup]
+
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        limit = settings.BULK_USER_MAX_IDS
+        if 'ids' in data:
+            users = User.objects.filter(pk__in=data['ids'])
+        else:
+            users = filter_users(User.objects.all(), **data['filter'])
+        # admins can't lock themselves out
+        user_ids = list(users.exclude(pk=request.user.pk).order_by('pk').values_list('pk', flat=True)[:limit + 1])
+        # a filter is held to the same limit as a list of ids
+        if len(user_ids) > limit:
+            return Response(
+                {'filter': [f"Matches more than {limit} users, narrow it down."]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        changed = bulk.apply(data['action'], user_ids, data.get('group'))
+
+        return Response({
+            'action': data['action'],
+            'matched': len(user_ids),
+            'changed': changed,
+        }, status=status.HTTP_200_OK)
+
+class UserBatchView(generics.GenericAPIView):
+    """
+    Public profiles (name, role, avatar) of up to USER_BATCH_MAX_IDS users,
+    ?ids=<uuid>,<uuid>,... Unknown and inactive users are left out, the
+    results keep the order of the ids.
+    """
+    serializer_class = PublicProfileSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        ids = [part for part in request.query_params.get('ids', '').split(',') if part]
+        query = UserBatchSerializer(data={'ids': ids})
+        query.is_valid(raise_exception=True)
+        user_ids = list(dict.fromkeys(query.validated_data['ids']))
+
+        # cached per user, only the users not in the cache are loaded
+        profiles = get_public_profiles(user_ids, self.load)
+        results = [self.absolute(profiles[user_id]) for user_id in user_ids if user_id in profiles]
+        return Response({'results': results})
+
+    def load(self, user_ids):
+        # one query for the users and one for the groups behind their roles
+        users = (
+            User.objects.filter(pk__in=user_ids, is_active=True)
+            .only('id', 'first_name', 'last_name', 'profile_image', 'profile_image_variants')
+            .prefetch_related(Prefetch('groups', queryset=Group.objects.only('id', 'name')))
+        )
+        return {user.pk: dict(self.get_serializer(user).data) for user in users}
+
+    def absolute(self, profile):
+        # the cache holds storage urls, shared by all hosts
+        build = self.request.build_absolute_uri
+        return {
+            **profile,
+            'profile_image': build(profile['profile_image']) if profile['profile_image'] else None,
+            'profile_image_variants': {size: build(url) for size, url in profile['profile_image_variants'].items()},
+        }
 
 class PasswordResetRequestView(generics.GenericAPIView):
     serializer_class = PasswordResetRequestSerializer
     permission_classes = [permissions.AllowAny]
+    throttle_classes = OTP_THROTTLE_CLASSES
+    throttle_scope = 'password_reset'
 
     def post(self, request):
         serializer = self.get_serializer(data=request.data)
@@ -142,6 +310,8 @@ class PasswordResetRequestView(generics.GenericAPIView):
 class PasswordResetConfirmView(generics.GenericAPIView):
     serializer_class = SetNewPasswordSerializer
     permission_classes = [permissions.AllowAny]
+    throttle_classes = OTP_THROTTLE_CLASSES
+    throttle_scope = 'password_reset_confirm'
 
     def patch(self, request):
         serializer = self.get_serializer(data=request.data)
@@ -151,4 +321,15 @@ class PasswordResetConfirmView(generics.GenericAPIView):
         return Response(
             {'message': 'Password reset successful.'},
             status=status.HTTP_200_OK
-        )
\ No newline at end of file
+        )
+
+
+@require_GET
+def metrics_view(request):
+    # Prometheus scrape endpoint, see users.metrics. Only open without a token while DEBUG is on.
+    token = settings.METRICS_TOKEN
+    if not token and not settings.DEBUG:
+        return HttpResponse(status=403)
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(status=401)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
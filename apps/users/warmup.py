@@ -0,0 +1,90 @@
+"""
+Work that would otherwise happen lazily while a worker serves its first requests.
+
+warm() is meant to run once in the master process before a prefork server
+forks (config/wsgi.py and config/asgi.py call it at import, so it runs in the
+master with gunicorn --preload), the workers then inherit the result. It
+starts no threads and closes its database connections, neither survives a fork.
+"""
+import logging
+import time
+
+from django.apps import apps
+from django.contrib.auth.hashers import get_hashers
+from django.contrib.auth.password_validation import get_default_password_validators
+from django.db import DatabaseError, connections
+from django.urls import get_resolver, reverse
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import groups
+from .otp import get_otp_backend
+
+logger = logging.getLogger(__name__)
+
+
+def warm_groups():
+    groups.warm()
+
+
+def warm_password_validators():
+    # CommonPasswordValidator reads its 20k password list when it is created
+    get_default_password_validators()
+    get_hashers()
+
+
+def _compile_patterns(patterns):
+    for pattern in patterns:
+        pattern.pattern.regex
+        if hasattr(pattern, 'url_patterns'):
+            _compile_patterns(pattern.url_patterns)
+
+
+def warm_url_resolvers():
+    # imports every urlconf and view module, compiles the route regexes and builds the reverse lookup
+    _compile_patterns(get_resolver().url_patterns)
+    reverse('login')
+
+
+def warm_jwt():
+    # loads the signing and verifying keys and the algorithm, round trip through a token
+    token = AccessToken()
+    token[api_settings.USER_ID_CLAIM] = 'warmup'
+    AccessToken(str(token))
+
+
+def warm_orm():
+    # relation trees of every model, built on the first query that touches them
+    for model in apps.get_models():
+        model._meta.get_fields()
+    get_otp_backend()
+
+
+STEPS = [
+    ('groups', warm_groups),
+    ('password validators', warm_password_validators),
+    ('url resolvers', warm_url_resolvers),
+    ('jwt', warm_jwt),
+    ('orm', warm_orm),
+]
+
+
+def warm():
+    """
+    Runs every warmup step, returns {step: seconds}. A step that needs the
+    database is skipped when it isn't reachable, the work then happens lazily.
+    """
+    timings = {}
+    try:
+        for name, step in STEPS:
+            started = time.perf_counter()
+            try:
+                step()
+            except DatabaseError as exc:
+                logger.warning("Warmup step '%s' skipped: %s", name, exc)
+            timings[name] = time.perf_counter() - started
+    finally:
+        connections.close_all()
+
+    logger.info("Warmed up in %.0f ms", sum(timings.values()) * 1000)
+    return timings
@@ -8,9 +8,32 @@ https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 """
 
 import os
+from pathlib import Path
 
+import environ
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+env = environ.Env()
+environ.Env.read_env(os.path.join(Path(__file__).resolve().parent.parent, '.env'))
+
+# pick the settings module the same way manage.py does
+if env('ENVIRONMENT', default='local') == 'production':
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.prod')
+else:
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.local')
+
+# under ASGI the auth endpoints are served by the native async views (users.async_views)
+os.environ.setdefault('ASYNC_AUTH_VIEWS', 'True')
+# each request's sync code runs in a thread of its own, a persistent connection would
+# be left open in a thread that is thrown away. DB_POOL=True reuses connections instead.
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
 
 application = get_asgi_application()
+
+# done once in the master with gunicorn --preload, the workers inherit it
+from django.conf import settings  # noqa: E402
+
+if settings.WARMUP_ON_STARTUP:
+    from users.warmup import warm
+
+    warm()
@@ -68,9 +68,13 @@ REST_AUTH = {
     'JWT_AUTH_REFRESH_COOKIE': 'my-app-refresh-token',
     # This prevents it from trying to use the standard token model
     'TOKEN_MODEL': None, 
+    # issue Google login tokens with the same claims as the password login
+    'JWT_TOKEN_CLAIMS_SERIALIZER': 'users.serializers.CustomTokenObtainPairSerializer',
 }
 
 MIDDLEWARE = [
+    # first, so that it sees the whole request
+    'users.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -93,6 +97,49 @@ DATABASES = {
         )
 }
 
+# Read replicas, e.g. DATABASE_REPLICA_URLS=postgres://replica1/db,postgres://replica2/db
+# (two local SQLite files work as well). Reads are routed to them by users.routers,
+# writes and the reads that must see them go to 'default'.
+DATABASE_REPLICAS = []
+for number, url in enumerate(env.list('DATABASE_REPLICA_URLS', default=[]), start=1):
+    DATABASES[f'replica{number}'] = {**env.db_url_config(url), 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+if DATABASE_REPLICAS:
+    DATABASE_ROUTERS = ['users.routers.PrimaryReplicaRouter']
+    # right after ServerTimingMiddleware, before anything reads from the database
+    MIDDLEWARE.insert(1, 'users.middleware.ReplicaPinMiddleware')
+
+# reads stay on the primary this long after a client wrote, should exceed the replication lag
+REPLICA_STICKY_SECONDS = env.int('REPLICA_STICKY_SECONDS', default=5)
+REPLICA_PIN_COOKIE = 'db_primary_until'
+
+for database in DATABASES.values():
+    # Keep connections open between requests instead of connecting (and authenticating) on
+    # every request, a health check before reuse replaces connections the server dropped.
+    # Persistent connections are per thread, config/asgi.py turns them off (use the pool below).
+    database['CONN_MAX_AGE'] = env.int('DB_CONN_MAX_AGE', default=60)
+    database['CONN_HEALTH_CHECKS'] = env.bool('DB_CONN_HEALTH_CHECKS', default=True)
+
+    # In-process connection pool, Postgres with psycopg 3 only (pip install '.[pool]').
+    # Django hands connections back to the pool at the end of each request, so it
+    # requires CONN_MAX_AGE = 0.
+    if env.bool('DB_POOL', default=False) and database['ENGINE'] == 'django.db.backends.postgresql':
+        database['CONN_MAX_AGE'] = 0
+        database.setdefault('OPTIONS', {})['pool'] = {
+            'min_size': env.int('DB_POOL_MIN_SIZE', default=2),
+            'max_size': env.int('DB_POOL_MAX_SIZE', default=10),
+            'timeout': env.float('DB_POOL_TIMEOUT', default=10),  # seconds to wait for a free connection
+        }
+
+# Cache, shared between all app nodes in production (e.g. CACHE_URL=redis://host:6379/0)
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
+# how long resolved group memberships stay cached, they are invalidated on change
+USER_ROLE_CACHE_TIMEOUT = 60 * 60
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -110,6 +157,21 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'config.wsgi.application'
 
+# Password hashing. PASSWORD_HASHER picks the hasher for new hashes, the others are
+# kept so existing hashes still verify and get upgraded on login.
+PASSWORD_HASH_ITERATIONS = env.int('PASSWORD_HASH_ITERATIONS', default=1_000_000)
+PASSWORD_HASHING_WORKERS = env.int('PASSWORD_HASHING_WORKERS', default=os.cpu_count())
+PASSWORD_HASHER = env('PASSWORD_HASHER', default='users.hashing.ConfigurablePBKDF2PasswordHasher')
+PASSWORD_HASHERS = [PASSWORD_HASHER] + [
+    hasher for hasher in [
+        'users.hashing.ConfigurablePBKDF2PasswordHasher',
+        'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+        'django.contrib.auth.hashers.Argon2PasswordHasher',
+        'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+        'django.contrib.auth.hashers.ScryptPasswordHasher',
+    ] if hasher != PASSWORD_HASHER
+]
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -144,15 +206,47 @@ STATIC_URL = 'static/'
 # auth user model
 AUTH_USER_MODEL = 'users.User'
 
+# ModelBackend, with the async login hashing on the executor from users.hashing
+AUTHENTICATION_BACKENDS = ['users.backends.ExecutorModelBackend']
+
+# Serve register/login/verify/resend/password-reset/profile through the async views
+# in users.async_views, switched on by config/asgi.py
+ASYNC_AUTH_VIEWS = env.bool('ASYNC_AUTH_VIEWS', default=False)
+
+# Build request.user from the token claims instead of loading the user row on every request
+JWT_STATELESS_AUTH = env.bool('JWT_STATELESS_AUTH', default=False)
+
+# how long a user's token version stays cached, it is invalidated whenever it is bumped
+TOKEN_VERSION_CACHE_TIMEOUT = 60 * 60 * 24
+
 # DRF Config
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.StatelessJWTAuthentication'
+        if JWT_STATELESS_AUTH else
+        'users.authentication.VersionedJWTAuthentication',
     ),
     # 'DEFAULT_PERMISSION_CLASSES': (
     #     'rest_framework.permissions.IsAuthenticated',
     # ),
     # 'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+
+    # policies for users.throttling, '<throttle_scope>_ip', '<throttle_scope>_email'
+    # and '<throttle_scope>_cooldown', counted in the shared cache
+    'DEFAULT_THROTTLE_RATES': {
+        'register_ip': '20/hour',
+        'register_email': '5/hour',
+        'verify_email_ip': '60/hour',
+        'verify_email_email': '10/15m',
+        'resend_activation_ip': '20/hour',
+        'resend_activation_email': '5/hour',
+        'resend_activation_cooldown': '1/60s',
+        'password_reset_ip': '20/hour',
+        'password_reset_email': '5/hour',
+        'password_reset_cooldown': '1/60s',
+        'password_reset_confirm_ip': '60/hour',
+        'password_reset_confirm_email': '10/15m',
+    },
 }
 
 # ALLAUTH CONFIGURATION
@@ -200,14 +294,104 @@ STORAGES = {
     },
 }
 
-# Cloudinary configuration
-CLOUDINARY_STORAGE = {
-    'CLOUD_NAME': env('CLOUDINARY_CLOUD_NAME'),
-    'API_KEY': env('CLOUDINARY_API_KEY'),
-    'API_SECRET': env('CLOUDINARY_API_SECRET'),
-}
+# Cloudinary configuration, only needed with MEDIA_STORAGE=cloudinary
+if env('CLOUDINARY_CLOUD_NAME', default=None):
+    CLOUDINARY_STORAGE = {
+        'CLOUD_NAME': env('CLOUDINARY_CLOUD_NAME'),
+        'API_KEY': env('CLOUDINARY_API_KEY'),
+        'API_SECRET': env('CLOUDINARY_API_SECRET'),
+    }
 
 DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
 
 # Media settings
-MEDIA_URL = '/media/'  # Public URL for media
\ No newline at end of file
+MEDIA_URL = '/media/'  # Public URL for media
+MEDIA_ROOT = env('MEDIA_ROOT', default=str(BASE_DIR / 'media'))
+
+# choices for STORAGES['default'], picked with MEDIA_STORAGE in local.py / prod.py
+MEDIA_STORAGE_BACKENDS = {
+    'cloudinary': 'cloudinary_storage.storage.MediaCloudinaryStorage',
+    # content-addressed files under MEDIA_ROOT, see users.storage
+    'local': 'users.storage.ContentAddressedStorage',
+}
+
+# Background jobs (avatar downloads, image processing) run in a per-process thread pool
+BACKGROUND_TASK_WORKERS = env.int('BACKGROUND_TASK_WORKERS', default=4)
+
+# Google avatar ingestion
+AVATAR_FETCH_TIMEOUT = (3, 5)  # (connect, read) seconds
+AVATAR_MAX_BYTES = 5 * 1024 * 1024
+AVATAR_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+# Profile images are re-encoded as JPEG and stored with a fixed set of thumbnails
+PROFILE_IMAGE_MAX_SIZE = 1024
+PROFILE_IMAGE_VARIANT_SIZES = (64, 128, 256)
+PROFILE_IMAGE_QUALITY = 85
+PROFILE_IMAGE_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+# One time passwords. users.otp.CacheOTPBackend keeps codes in the cache with a native TTL
+# and needs a shared CACHE_URL, the OneTimePassword table backend works with any setup.
+OTP_BACKEND = env('OTP_BACKEND', default='users.otp.DatabaseOTPBackend')
+OTP_TTL = 5 * 60  # seconds
+OTP_MAX_ATTEMPTS = 5  # wrong guesses before a cached code is discarded
+
+# accounts that never verified their email are deleted after this many days
+UNVERIFIED_ACCOUNT_TTL_DAYS = 7
+
+# Email outbox, drained by `manage.py send_queued_emails`
+EMAIL_OUTBOX_BATCH_SIZE = env.int('EMAIL_OUTBOX_BATCH_SIZE', default=50)
+EMAIL_OUTBOX_MAX_ATTEMPTS = env.int('EMAIL_OUTBOX_MAX_ATTEMPTS', default=5)
+EMAIL_OUTBOX_RETRY_BACKOFF = 30  # seconds, doubled after every failed attempt
+EMAIL_OUTBOX_MAX_BACKOFF = 60 * 60
+EMAIL_OUTBOX_CLAIM_TIMEOUT = 5 * 60  # a claimed message is retried if the worker dies mid-batch
+EMAIL_OUTBOX_POLL_INTERVAL = 2
+EMAIL_OUTBOX_RETENTION_DAYS = 7  # sent and failed messages are deleted by sweep_stale_data after this
+
+# users.middleware.ServerTimingMiddleware: per request db/hash/storage/http/email time in a
+# Server-Timing header, SERVER_TIMING_HEADER defaults to DEBUG (see local.py / prod.py)
+# the slowest queries of sampled requests above the threshold are logged to 'users.middleware'
+SLOW_REQUEST_THRESHOLD_MS = env.int('SLOW_REQUEST_THRESHOLD_MS', default=500)
+SLOW_REQUEST_SAMPLE_RATE = env.float('SLOW_REQUEST_SAMPLE_RATE', default=0.1)
+SLOW_REQUEST_TOP_QUERIES = 5
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'users': {'handlers': ['console'], 'level': env('USERS_LOG_LEVEL', default='INFO')},
+    },
+}
+
+# cached GET /auth/profile/ representations, see users.profile_cache
+PROFILE_CACHE_TIMEOUT = 60 * 60
+
+# last_login and AuthEvent rows are buffered per process and written in bulk (users.auth_events),
+# 0 writes every login right away
+AUTH_EVENT_FLUSH_INTERVAL = env.int('AUTH_EVENT_FLUSH_INTERVAL', default=5)  # seconds
+AUTH_EVENT_BUFFER_SIZE = 500  # written early once this many events are waiting
+
+# Logout / revoked tokens (users.revocation), checked through a Bloom filter in every process
+REVOCATION_SYNC_INTERVAL = env.int('REVOCATION_SYNC_INTERVAL', default=10)  # seconds until other nodes see a logout
+REVOCATION_REBUILD_INTERVAL = 60 * 60  # drops expired tokens from the filter
+REVOCATION_BLOOM_CAPACITY = 100_000
+REVOCATION_BLOOM_ERROR_RATE = 0.001
+
+# bulk admin operations (POST /auth/users/bulk/)
+BULK_USER_MAX_IDS = 10_000
+BULK_USER_CHUNK_SIZE = 1000  # rows per UPDATE / INSERT / DELETE and transaction
+
+# runs users.warmup when config/wsgi.py or config/asgi.py is imported, before a prefork server forks
+WARMUP_ON_STARTUP = env.bool('WARMUP_ON_STARTUP', default=True)
+
+# Prometheus metrics at /metrics (users.metrics). Prefork servers need METRICS_DIR,
+# a directory shared by the workers and emptied on restart, for the scrape to see all of them.
+METRICS_DIR = env('METRICS_DIR', default=None)
+METRICS_FLUSH_INTERVAL = 5  # seconds between snapshots of a process' metrics
+# required as a Bearer token, without it /metrics is only served while DEBUG is on
+METRICS_TOKEN = env('METRICS_TOKEN', default=None)
+
+# GET /auth/users/batch/?ids=
+USER_BATCH_MAX_IDS = 200
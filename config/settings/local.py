@@ -3,10 +3,15 @@ from .base import *
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
+SERVER_TIMING_HEADER = env.bool('SERVER_TIMING_HEADER', default=DEBUG)
+
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = os.environ.setdefault('SECRET_KEY', 'django-insecure-l5tdl19q+t8imusp66ho52ndscqs(qf683@1#y9kgmc#%w((t%')
 
 # default to allow everything if ALLOWED_HOSTS is missing in .env
 ALLOWED_HOSTS = env.list('ALLOWED_HOSTS', default=['*'])
 
-EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
\ No newline at end of file
+EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+
+# media on local disk, MEDIA_STORAGE=cloudinary uploads to Cloudinary instead
+STORAGES['default'] = {'BACKEND': MEDIA_STORAGE_BACKENDS[env('MEDIA_STORAGE', default='local')]}
@@ -2,8 +2,14 @@ from .base import *
 
 DEBUG = False
 
+# internal db/cache timings stay out of production responses unless asked for
+SERVER_TIMING_HEADER = env.bool('SERVER_TIMING_HEADER', default=DEBUG)
+
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = os.environ.setdefault('SECRET_KEY')
 
 # Strict allowed hosts from ENV
-ALLOWED_HOSTS = env.list('ALLOWED_HOSTS')
\ No newline at end of file
+ALLOWED_HOSTS = env.list('ALLOWED_HOSTS')
+
+# MEDIA_STORAGE=local keeps media on disk (MEDIA_ROOT), e.g. a volume shared by the app nodes
+STORAGES['default'] = {'BACKEND': MEDIA_STORAGE_BACKENDS[env('MEDIA_STORAGE', default='cloudinary')]}
@@ -1,8 +1,17 @@
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
+from users.views import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
 
     path('auth/', include('users.urls')),
+
+    path('metrics', metrics_view, name='metrics'),
 ]
+
+# media from MEDIA_STORAGE=local, only while DEBUG is on (static() is a no-op otherwise)
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
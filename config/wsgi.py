@@ -8,9 +8,27 @@ https://docs.djangoproject.com/en/6.0/howto/deployment/wsgi/
 """
 
 import os
+from pathlib import Path
 
+import environ
 from django.core.wsgi import get_wsgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+env = environ.Env()
+environ.Env.read_env(os.path.join(Path(__file__).resolve().parent.parent, '.env'))
+
+# pick the settings module the same way manage.py does
+if env('ENVIRONMENT', default='local') == 'production':
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.prod')
+else:
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.local')
 
 application = get_wsgi_application()
+
+# done once in the master with gunicorn --preload, the workers inherit it
+from django.conf import settings  # noqa: E402
+
+if settings.WARMUP_ON_STARTUP:
+    from users.warmup import warm
+
+    warm()
+